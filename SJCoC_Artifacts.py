@@ -0,0 +1,90 @@
+# Cache of the downloadable files of a report (the excel report, the charts pdf, the exports...), for the streamlit app
+# A file is only built the first time it is downloaded, and is kept per input fingerprint (see run_pipeline), so reruns of the
+# script and other sessions with the same data download the cached file instead of building it again
+
+import threading
+from collections import OrderedDict
+from SJCoC_Diagnostics import StageTimings, recording, stage
+
+# Number of builds whose stage timings are kept for the diagnostics panel (see build_timings)
+BUILD_TIMINGS_KEPT = 64
+
+
+# Least recently used cache of built files, bounded by their total size
+class ArtifactCache:
+
+    def __init__(self, max_bytes=512 * 1024**2):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._entries = OrderedDict()      # (fingerprint, name) -> bytes
+        self._building = {}                # (fingerprint, name) -> lock held while the file is built
+        self._timings = OrderedDict()      # (fingerprint, name) -> stage timings of the last build of the file
+        self._lock = threading.Lock()      # streamlit serves every browser session from its own thread
+
+    def _cached(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return(None)
+            self._entries.move_to_end(key)  # marks the file as the most recently used
+            return(self._entries[key])
+
+    # Function that gives the file called name of the data with this fingerprint, build() makes it when it isn't cached
+    # (two sessions asking for the same file at once build it once)
+    # The build runs after the script run that offered the file, so its stages are recorded here (see build_timings)
+    def get(self, fingerprint, name, build):
+        key = (fingerprint, name)
+        data = self._cached(key)
+        if data is not None:
+            return(data)
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            data = self._cached(key)
+            if data is None:
+                with recording() as timings, stage(f'build {name}'):
+                    data = build()
+                self.put(key, data)
+                self._keep_timings(key, timings)
+        with self._lock:
+            self._building.pop(key, None)
+        return(data)
+
+    def put(self, key, data):
+        # A file that alone is larger than the bound is not cached, it would only evict everything else
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self.used_bytes += len(data)
+            # Evicting the least recently used files until the cache fits in its bound again
+            while self.used_bytes > self.max_bytes:
+                old_key, old_data = self._entries.popitem(last=False)
+                self.used_bytes -= len(old_data)
+
+    def _keep_timings(self, key, timings):
+        with self._lock:
+            self._timings.pop(key, None)
+            self._timings[key] = timings
+            while len(self._timings) > BUILD_TIMINGS_KEPT:
+                self._timings.popitem(last=False)
+
+    # Function that gives the stages of the files built for the data with this fingerprint, in the order they were built
+    def build_timings(self, fingerprint):
+        timings = StageTimings()
+        with self._lock:
+            for (built_fingerprint, name), build in self._timings.items():
+                if built_fingerprint == fingerprint:
+                    timings.add_stages(build)
+        return(timings)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._timings.clear()
+            self.used_bytes = 0
+
+
+# Cache shared by every rerun of the streamlit script (imported modules stay loaded between reruns)
+artifact_cache = ArtifactCache()
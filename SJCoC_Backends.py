@@ -0,0 +1,345 @@
+# Compute backends that run the heavy stages of performance(): the cleaning and join, and the Q23c household counts
+# Every backend takes and returns pandas dataframes, so performance() lays out the same report whichever engine ran the stages
+#   clean(d_entry, d_exit) -> (cleaned data, destinations without a category, number of duplicate exit records collapsed)
+#   household_counts(clean) -> (distinct households per Destination and Household Type, number of heads of household counted)
+#   grouped_household_counts(clean, slices) -> {slice label: household_counts(rows of the slice)} for every label in slices, in one grouped pass
+
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from SJCoC_Ingest import compact_category, compact_ids, ENTRY_COLUMNS, EXIT_COLUMNS, ID_COLUMNS
+from SJCoC_Dates import calculate_ages, parse_dates, DATE_COLUMNS
+from SJCoC_Destinations import destination_types
+from SJCoC_Diagnostics import timed, stage, start_stage
+from SJCoC_Memory import check_memory
+
+# Columns of the cleaned data that repeat a handful of long strings, stored as categoricals
+category_columns = ["Gender", "Race", "Ethnicity", "Destination", "Destination Type", "Household Type", "Relationship to Head of Household"]
+
+# Columns household_counts() needs from the cleaned data
+count_columns = ["Housing Move-In Date", "Relationship to Head of Household", "Destination", "Destination Type", "Household Type", "Household ID"]
+
+# Columns that order the exit records of one enrollment by their text, the record that sorts last is the one kept (see last_exit_records)
+EXIT_RECORD_ORDER = ["Destination", "Specify Other Exit Destination"]
+
+
+# Function that gives the Entry columns the cleaned data keeps: the ones performance() uses, and any other Entry column the sheet
+# was read with (normalize_sheet only keeps the columns asked for, ie. a project column to split the report by)
+def entry_columns(d_entry):
+    return(ENTRY_COLUMNS + [col for col in d_entry.columns if col not in ENTRY_COLUMNS + EXIT_COLUMNS])
+
+
+# Function that keeps one exit record per enrollment (enrollment_key), and gives the number of records it collapsed
+# The records of an enrollment share its exit date (it is part of the key), so the one kept is the record whose Destination and then
+# Specify Other Exit Destination sort last as text, blank values first: a record with a destination wins over a blank one, and the
+# same data gives the same report whatever order its files were uploaded in
+def last_exit_records(d_exit):
+    repeated = d_exit['enrollment_key'].duplicated(keep=False).to_numpy()
+    if not repeated.any():
+        return(d_exit, 0)
+    records = d_exit[repeated]
+    order = pd.DataFrame({'enrollment_key': records['enrollment_key'].to_numpy(),
+                          **{col: records[col].astype(object).to_numpy() for col in EXIT_RECORD_ORDER}})
+    kept = order.sort_values(EXIT_RECORD_ORDER, na_position='first', kind='mergesort').drop_duplicates('enrollment_key', keep='last').index
+    return(pd.concat([d_exit[~repeated], records.iloc[np.sort(kept)]]), len(records) - len(kept))
+
+
+# Function that splits the distinct household counts of every slice into the household_counts() table of each slice
+# counts: one row per (slice code, Destination, Household Type) with its number of households, heads: heads of household per slice code
+def split_slice_counts(counts, heads, labels):
+    counts = counts.set_index(['slice', 'Destination', 'Household Type'])['households'].unstack(fill_value=0)
+    sliced = {}
+    for code, label in enumerate(labels):
+        if code in counts.index.get_level_values(0):
+            household_counts = counts.xs(code, level='slice')
+            household_counts = household_counts.loc[:, (household_counts > 0).any()]   # only the household types of this slice
+        else:
+            household_counts = pd.DataFrame()
+        sliced[label] = (household_counts, int(heads[code]))
+    return(sliced)
+
+
+# Function that stores the repeated strings of the cleaned data as categoricals and the IDs as compact integers
+# Every backend finishes its cleaned data with this, so they all return the same column types
+def compact_clean(d):
+    for col in d.columns:
+        if col in category_columns or isinstance(d[col].dtype, pd.CategoricalDtype):
+            d[col] = compact_category(d[col])
+    for col in ID_COLUMNS:
+        d[col] = compact_ids(d[col])
+    return(d)
+
+
+# =============================================================================
+# The pandas backend, runs every stage in this process with pandas and numpy
+class PandasBackend:
+
+    name = 'pandas'
+
+    def clean(self, d_entry, d_exit):
+        # Removing duplicate rows in the entry and exit data
+        dedup = start_stage('dedup')
+        d_entry = d_entry.drop_duplicates()
+        d_exit = d_exit.drop_duplicates()
+        dedup.stop(len(d_entry) + len(d_exit))
+        check_memory('dedup')
+
+        # Focusing only on the attributes provided in the sample data
+        d_entry = d_entry[entry_columns(d_entry)]
+        d_exit = d_exit[EXIT_COLUMNS]
+
+        # Identifying the column names that the entry and exit data have in common (they identify an enrollment)
+        common_columns = list(d_entry.columns.intersection(d_exit.columns))
+
+        merge = start_stage('merge')
+
+        # Numbering every distinct enrollment so the join below is done on one compact integer key instead of eight columns
+        # The columns are turned into integer codes first, a missing value gets the code -1 so blank fields still match each other
+        # (grouping on categoricals with missing values gives them no group at all)
+        codes = {}
+        for col in common_columns:
+            if isinstance(d_entry[col].dtype, pd.CategoricalDtype) and isinstance(d_exit[col].dtype, pd.CategoricalDtype):
+                codes[col] = union_categoricals([d_entry[col], d_exit[col]], ignore_order=True).codes
+            else:
+                codes[col] = pd.factorize(pd.concat([d_entry[col], d_exit[col]], ignore_index=True))[0]
+        enrollment_key = pd.DataFrame(codes).groupby(common_columns, sort=False).ngroup().to_numpy()
+        d_entry = d_entry.assign(enrollment_key=enrollment_key[:len(d_entry)])
+        d_exit = d_exit.assign(enrollment_key=enrollment_key[len(d_entry):])
+
+        # An enrollment with several exit records would repeat its entry rows in the join, only one of them is kept (see last_exit_records)
+        d_exit, duplicate_exit_keys = last_exit_records(d_exit)
+
+        # Merging the entry and exit data on the enrollment key (every entry row matches at most one exit row)
+        exit_columns = ['enrollment_key'] + [col for col in d_exit.columns if col not in common_columns + ['enrollment_key']]
+        d = pd.merge(d_entry, d_exit[exit_columns], how='left', on='enrollment_key').drop(columns='enrollment_key')
+        merge.stop(len(d))
+        check_memory('merge')
+
+        # Resolving one move-in date per household (the earliest one) and broadcasting it to every member of the household
+        # Rows without a Household ID keep their own move-in date
+        with stage('move-in dates') as s:
+            move_date = parse_dates(d['Housing Move-In Date'])
+            d['Housing Move-In Date'] = move_date.groupby(d['Household ID']).transform('min').fillna(move_date)
+            s.rows = len(d)
+
+
+        # We want to calculate indiviual's ages at the time they left the program. so we will focus on those that have an exit date
+        age_stage = start_stage('age')
+        d = d[(d['Enrollment Exit Date'].notna())]
+
+        # Creating a new column that contains the individual's age upon their exit from the program
+        # The DOB and exit date columns are parsed as a whole (text or excel dates), missing or unreadable dates give a NaN age
+        d['Age'] = calculate_ages(d['DOB'], d['Enrollment Exit Date'])
+        age_stage.stop(len(d))
+
+        # Numbering the households so the adult, child and NaN age counts of every household come from one pass over the rows
+        typing = start_stage('household typing')
+        household_codes, households = pd.factorize(d['Household ID'])
+        known = household_codes >= 0      # rows without a Household ID (code -1) belong to no household
+
+        # Each row is an adult (0), a child (1) or has a NaN age to account for Unknown Household types (2)
+        age = d['Age'].to_numpy(dtype=float)
+        age_group = np.where(np.isnan(age), 2, np.where(age >= 18, 0, 1))
+
+        # Counting all three groups of every household at once, one row of the counts array per household
+        counts = np.bincount(household_codes[known] * 3 + age_group[known], minlength=len(households) * 3).reshape(-1, 3)
+
+        # Broadcasting the household counts back onto the rows of each household (NaN for rows without a household)
+        counts = np.where(known[:, None], counts[household_codes], np.nan)
+        d['Adults per Household'] = counts[:, 0]
+        d['Children per Household'] = counts[:, 1]
+        d['na_ages'] = counts[:, 2]
+        adults, children, na_ages = counts[:, 0], counts[:, 1], counts[:, 2]
+
+        # Creating a column that assigns household type, a row matching none of the conditions is "Unknown"
+        d["Household Type"] = np.select([(adults > 0) & (children == 0) & (na_ages == 0),
+                                         (adults > 0) & (children > 0),
+                                         (adults == 0) & (children > 0) & (na_ages == 0)],
+                                        ["Without Children", "With Children and Adults", "With Only Children"],
+                                        default="Unknown")
+        typing.stop(len(d))
+        check_memory('household typing')
+
+        # Assigning housing destination types with the precomputed destination -> destination type lookup
+        # (Destination is categorical, so map() only looks up each distinct destination once)
+        with stage('destination typing') as s:
+            d['Destination Type'] = d['Destination'].map(destination_types)
+
+            # Destinations that aren't in any category get no Destination Type, they are reported together instead of silently dropped
+            unknown_destinations = sorted(str(dest) for dest in d['Destination'].dropna().unique() if dest not in destination_types)
+            s.rows = len(d)
+
+        with stage('compact columns'):
+            d = compact_clean(d)
+
+        return(d, unknown_destinations, duplicate_exit_keys)
+
+    @timed('Q23c aggregation')
+    def household_counts(self, clean):
+        # This subset excludes those that do NOT have a move-in date
+        d = clean[(clean['Housing Move-In Date'].notna()) & (clean['Relationship to Head of Household']=='Self (head of household)')]
+        d = d[d['Destination Type'].notna()]
+
+        # Counting the distinct households of every destination and household type in one grouped pass
+        # (a household has a single Household Type, so the distinct households of a destination are the sum over its types)
+        households = d[['Destination', 'Household Type', 'Household ID']].drop_duplicates()
+        household_counts = households.groupby(['Destination', 'Household Type'], observed=True).size().unstack(fill_value=0)
+
+        return(household_counts, d.shape[0])
+
+    @timed('Q23c aggregation (grouped)')
+    def grouped_household_counts(self, clean, slices):
+        # The slices are numbered so the grouping runs on one integer column (labels are sorted, so are the slices)
+        codes, labels = pd.factorize(slices, sort=True)
+        heads = (clean['Housing Move-In Date'].notna() & (clean['Relationship to Head of Household']=='Self (head of household)')
+                 & clean['Destination Type'].notna()).to_numpy()
+
+        # Counting the distinct households of every slice, destination and household type in one grouped pass
+        d = clean.loc[heads, ['Destination', 'Household Type', 'Household ID']].assign(slice=codes[heads])
+        counts = d.drop_duplicates().groupby(['slice', 'Destination', 'Household Type'], observed=True).size().rename('households').reset_index()
+
+        return(split_slice_counts(counts, np.bincount(codes[heads], minlength=len(labels)), labels))
+
+
+# =============================================================================
+# The polars backend, runs the stages as polars expressions on an Arrow-backed frame using every core
+# polars (1.32 or later, where categoricals of different frames can be joined) is an optional dependency, it is only imported when this backend is used
+class PolarsBackend:
+
+    name = 'polars'
+
+    def __init__(self):
+        try:
+            import polars
+        except ImportError:
+            raise ImportError("The polars backend needs the polars package (pip install polars)")
+
+    # Function that converts a pandas frame to polars with its dates parsed to datetimes (categoricals stay categoricals)
+    @staticmethod
+    def to_polars(df):
+        import polars as pl
+        df = df.assign(**{col: parse_dates(df[col]) for col in DATE_COLUMNS if col in df.columns})
+        return(pl.from_pandas(df))
+
+    # (the query runs its stages as one plan, so the diagnostics only time the cleaning as a whole)
+    def clean(self, d_entry, d_exit):
+        import polars as pl
+
+        # The stages are chained into one lazy query, polars plans it as a whole and runs it across every core
+        # Removing duplicate rows in the entry and exit data, then focusing only on the attributes provided in the sample data
+        entry = self.to_polars(d_entry).lazy().unique(keep='first', maintain_order=True).select(entry_columns(d_entry))
+        exit = self.to_polars(d_exit).lazy().unique(keep='first', maintain_order=True).select(EXIT_COLUMNS)
+        common_columns = [col for col in ENTRY_COLUMNS if col in EXIT_COLUMNS]
+
+        # The columns identifying an enrollment get the same type on both sides (ie. IDs that are integers in one file and floats in the other)
+        key_types = pl.concat([entry.select(common_columns), exit.select(common_columns)], how='vertical_relaxed').collect_schema()
+        entry = entry.with_columns([pl.col(col).cast(dtype) for col, dtype in key_types.items()])
+        exit = exit.with_columns([pl.col(col).cast(dtype) for col, dtype in key_types.items()])
+
+        # An enrollment with several exit records would repeat its entry rows in the join, only one of them is kept: the one whose
+        # destination texts sort last, blank values first (see last_exit_records)
+        exit = exit.sort([pl.col(col).cast(pl.String) for col in EXIT_RECORD_ORDER], nulls_last=False, maintain_order=True)
+        last_exit = pl.struct(common_columns).is_last_distinct()
+        duplicate_exit_keys = exit.select((~last_exit).sum())
+        exit = exit.filter(last_exit)
+
+        # Joining the entry and exit data on the enrollment columns (missing values match each other like in pandas)
+        # The row number becomes the index of the cleaned data, the same index pandas gives the merged rows
+        d = entry.with_row_index('row').join(exit, on=common_columns, how='left', nulls_equal=True, maintain_order='left')
+
+        # Resolving one move-in date per household (the earliest one), rows without a Household ID keep their own move-in date
+        move_date = pl.col('Housing Move-In Date')
+        household = pl.col('Household ID')
+        d = d.with_columns(pl.when(household.is_null()).then(move_date)
+                             .otherwise(move_date.min().over('Household ID').fill_null(move_date)).alias('Housing Move-In Date'))
+
+        # Only the individuals that have an exit date, with their age upon their exit from the program
+        born, left = pl.col('DOB'), pl.col('Enrollment Exit Date')
+        birthday_not_reached = (left.dt.month().cast(pl.Int32) * 100 + left.dt.day()) < (born.dt.month().cast(pl.Int32) * 100 + born.dt.day())
+        d = d.filter(left.is_not_null())
+        d = d.with_columns((left.dt.year().cast(pl.Int64) - born.dt.year() - birthday_not_reached.cast(pl.Int64)).alias('Age'))
+
+        # Adult, child and NaN age counts of every household broadcast onto its rows (missing for rows without a household)
+        age = pl.col('Age')
+        def per_household(condition):
+            return(pl.when(household.is_null()).then(None).otherwise(condition.fill_null(False).sum().over('Household ID')).cast(pl.Float64))
+        d = d.with_columns(per_household(age >= 18).alias('Adults per Household'),
+                           per_household(age < 18).alias('Children per Household'),
+                           per_household(age.is_null()).alias('na_ages'))
+
+        # Household type and destination type of every row
+        adults, children, na_ages = pl.col('Adults per Household'), pl.col('Children per Household'), pl.col('na_ages')
+        d = d.with_columns(pl.when((adults > 0) & (children == 0) & (na_ages == 0)).then(pl.lit("Without Children"))
+                             .when((adults > 0) & (children > 0)).then(pl.lit("With Children and Adults"))
+                             .when((adults == 0) & (children > 0) & (na_ages == 0)).then(pl.lit("With Only Children"))
+                             .otherwise(pl.lit("Unknown")).alias('Household Type'),
+                           pl.col('Destination').cast(pl.String).replace_strict(destination_types, default=None, return_dtype=pl.String).alias('Destination Type'))
+
+        # Running the query, the duplicate count shares the exit data scan with it
+        d, duplicate_exit_keys = pl.collect_all([d, duplicate_exit_keys])
+        duplicate_exit_keys = int(duplicate_exit_keys.item())
+        check_memory('polars query')
+
+        # Destinations that aren't in any category get no Destination Type, they are reported together instead of silently dropped
+        unknown_destinations = sorted(str(dest) for dest in d['Destination'].drop_nulls().unique().to_list() if dest not in destination_types)
+
+        # Back to pandas, indexed by the merged row numbers
+        clean = d.to_pandas().set_index('row')
+        clean.index = clean.index.astype('int64').rename(None)
+
+        # polars has no unit coarser than milliseconds, the dates get back the unit the pandas backend keeps: the one the Entry dates
+        # came in (pandas 2 keeps datetime64[s] as is), or nanoseconds for dates parsed from text
+        clean = clean.astype({col: d_entry[col].dtype if pd.api.types.is_datetime64_dtype(d_entry[col]) else 'datetime64[ns]'
+                              for col in DATE_COLUMNS if col in clean.columns})
+
+        return(compact_clean(clean), unknown_destinations, duplicate_exit_keys)
+
+    @timed('Q23c aggregation')
+    def household_counts(self, clean):
+        import polars as pl
+
+        # Heads of household with a move-in date and a destination type
+        d = self.to_polars(clean[count_columns])
+        d = d.filter(pl.col('Housing Move-In Date').is_not_null() & (pl.col('Relationship to Head of Household') == 'Self (head of household)')
+                     & pl.col('Destination Type').is_not_null())
+
+        # Counting the distinct households of every destination and household type
+        counts = d.unique(subset=['Destination', 'Household Type', 'Household ID']).group_by(['Destination', 'Household Type']).len().to_pandas()
+        household_counts = counts.pivot(index='Destination', columns='Household Type', values='len').fillna(0).astype('int64')
+
+        return(household_counts, d.height)
+
+    @timed('Q23c aggregation (grouped)')
+    def grouped_household_counts(self, clean, slices):
+        import polars as pl
+
+        # The slices are numbered so the grouping runs on one integer column (labels are sorted, so are the slices)
+        codes, labels = pd.factorize(slices, sort=True)
+        d = self.to_polars(clean[count_columns]).with_columns(pl.Series('slice', codes))
+        d = d.filter(pl.col('Housing Move-In Date').is_not_null() & (pl.col('Relationship to Head of Household') == 'Self (head of household)')
+                     & pl.col('Destination Type').is_not_null())
+
+        # Counting the distinct households of every slice, destination and household type
+        counts = (d.unique(subset=['slice', 'Destination', 'Household Type', 'Household ID']).group_by(['slice', 'Destination', 'Household Type'])
+                  .len('households').to_pandas())
+        heads = np.bincount(d['slice'].to_numpy(), minlength=len(labels))
+
+        return(split_slice_counts(counts, heads, labels))
+
+
+# =============================================================================
+# Backends by name, and the one used when none is chosen (can be set with the SJCOC_BACKEND environment variable)
+BACKENDS = {'pandas': PandasBackend, 'polars': PolarsBackend}
+DEFAULT_BACKEND = os.environ.get('SJCOC_BACKEND', 'pandas')
+
+
+# Function that returns the backend with the given name (or the default backend), a backend object is returned as is
+def get_backend(backend=None):
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if not isinstance(backend, str):
+        return(backend)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown compute backend '{backend}', choose one of: {', '.join(BACKENDS)}")
+    return(BACKENDS[backend]())
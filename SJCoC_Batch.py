@@ -0,0 +1,255 @@
+# Headless command line entry point that generates the Q23c performance reports without streamlit or a browser
+#
+# Usage:
+#   python SJCoC_Batch.py reports/*.xlsx -o output            (one report per workbook)
+#   python SJCoC_Batch.py exports/ --combine -o output        (one report over every file, ie. entry and exit CSV files)
+#   python SJCoC_Batch.py exports/ --state CoC.state -o output  (appends only the files added since the last run)
+#   python SJCoC_Batch.py agencies/*.xlsx --combine --group-by "Source File" -o output  (plus one workbook with a sheet per agency file)
+#   python SJCoC_Batch.py exports/ --combine --export-clean parquet -o output  (plus the cleaned row level data, for audits)
+#   python SJCoC_Batch.py SJCoC_Snapshot.zip -o output        (a snapshot saved from the app, read like a workbook)
+
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# The report modules (pandas and the chart libraries behind them) are imported inside the functions that use them,
+# so --help and argument errors answer right away
+
+# File types that are picked up when a directory is given
+INPUT_PATTERNS = ['*.xlsx', '*.csv', '*.csv.gz', '*.zip']
+
+# Column that tags every Entry row with the name of the file it was read from, so a combined report can be split by file (ie. per agency)
+SOURCE_FILE_COLUMN = 'Source File'
+
+
+# Function that expands the given directories, glob patterns and file paths into a sorted list of input files
+def find_inputs(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for pattern in INPUT_PATTERNS:
+                paths.extend(glob.glob(os.path.join(item, pattern)))
+        elif glob.has_magic(item):
+            paths.extend(glob.glob(item))
+        else:
+            paths.append(item)
+    # Lock files excel leaves next to open workbooks (~$name.xlsx) are not reports
+    return(sorted(set(p for p in paths if not os.path.basename(p).startswith('~$'))))
+
+
+# Function that groups the input files into reports, every workbook is its own report unless they are combined into one
+def report_groups(paths, combine=False):
+    from SJCoC_Ingest import is_csv_name
+
+    if combine:
+        return([('Combined', paths)])
+    csv_files = [p for p in paths if is_csv_name(p)]
+    if csv_files:
+        raise ValueError(f"CSV files hold only one sheet each and need --combine to be paired into a report: {csv_files}")
+    return([(os.path.splitext(os.path.basename(p))[0], [p]) for p in paths])
+
+
+# Function that reads the input files of a report into one Entry and one Exit dataframe (None when no file holds that sheet)
+# group_by: column the report is split by, an Entry column is read along with the others and SOURCE_FILE_COLUMN is filled in per file
+def read_report_data(paths, group_by=None):
+    import pandas as pd
+    from SJCoC_Ingest import read_upload, normalize_sheet, ENTRY_COLUMNS, EXIT_COLUMNS
+    from SJCoC_Pipeline import FISCAL_YEAR
+    from SJCoC_Diagnostics import stage
+
+    extra_columns = [] if group_by in (None, FISCAL_YEAR, SOURCE_FILE_COLUMN) else [group_by]
+    d_entry, d_exit = [], []
+    for path in paths:
+        with stage(f'read {os.path.basename(path)}') as s:
+            entry, exit = read_upload(path, path, extra_columns)
+            s.rows = sum(len(df) for df in (entry, exit) if df is not None)
+        if entry is not None:
+            if group_by == SOURCE_FILE_COLUMN:
+                entry[SOURCE_FILE_COLUMN] = os.path.splitext(os.path.basename(path))[0]
+            d_entry.append(entry)
+        if exit is not None:
+            d_exit.append(exit)
+
+    if group_by == SOURCE_FILE_COLUMN:
+        extra_columns = [SOURCE_FILE_COLUMN]
+    df_entry = normalize_sheet(pd.concat(d_entry).reset_index(drop=True), ENTRY_COLUMNS + extra_columns) if d_entry else None
+    df_exit = normalize_sheet(pd.concat(d_exit).reset_index(drop=True), EXIT_COLUMNS) if d_exit else None
+    return(df_entry, df_exit)
+
+
+# Function that writes the excel report (and the charts pdf) of a pipeline result to the output directory
+# group_by: also writes the report split by this column (or FISCAL_YEAR), one sheet per slice in its own workbook
+# export: also writes the cleaned data in this format (see SJCoC_Export)
+def write_report(name, result, output_dir, charts=True, group_by=None, coc_title=None, backend=None, export=None):
+    from SJCoC_Worksheet_Format import to_excel, grouped_to_excel
+    from SJCoC_Q23c_Layout import COC_TITLE
+
+    coc_title = coc_title or COC_TITLE
+    written = []
+    excel_path = os.path.join(output_dir, f"{name}_Performance_Report.xlsx")
+    to_excel(result.performance_table, coc_title, target=excel_path)
+    written.append(excel_path)
+
+    if group_by:
+        from SJCoC_Pipeline import grouped_performance
+        grouped_path = os.path.join(output_dir, f"{name}_Performance_Report_by_{group_by.replace(' ', '_')}.xlsx")
+        grouped_to_excel(grouped_performance(result.clean, group_by, backend), group_by, coc_title, target=grouped_path)
+        written.append(grouped_path)
+
+    if export:
+        from SJCoC_Export import export_clean, EXPORT_EXTENSIONS
+        export_path = os.path.join(output_dir, f"{name}_Clean_Data{EXPORT_EXTENSIONS[export]}")
+        export_clean(result.clean, export_path, export)
+        written.append(export_path)
+
+    if charts:
+        from SJCoC_Charts import report_figures, charts_pdf
+        pdf_path = os.path.join(output_dir, f"{name}_Performance_Report_Charts.pdf")
+        with open(pdf_path, 'wb') as f:
+            f.write(charts_pdf(report_figures(result.charts)))
+        written.append(pdf_path)
+
+    return(written)
+
+
+# Function that builds one report from its input files and writes it to the output directory
+# Runs inside a worker process, so it only takes and returns plain values
+# diagnostics: also writes the wall time, rows and memory of every stage to {name}_Diagnostics.json
+# memory_budget: MB (or 'auto') the report may use, larger data is cleaned in groups of households (see SJCoC_Memory)
+def build_report(name, paths, output_dir, charts=True, backend=None, group_by=None, coc_title=None, diagnostics=False, memory_budget=None, export=None):
+    from SJCoC_Pipeline import run_pipeline
+    from SJCoC_Diagnostics import recording
+
+    with recording() as timings:
+        df_entry, df_exit = read_report_data(paths, group_by)
+        if df_entry is None or df_exit is None:
+            raise ValueError(f"'{name}' needs both the Entry data and the Exit data")
+        result = run_pipeline(df_entry, df_exit, backend=backend, memory_budget=memory_budget)
+        written = write_report(name, result, output_dir, charts, group_by, coc_title, backend, export)
+
+    if diagnostics:
+        diagnostics_path = os.path.join(output_dir, f"{name}_Diagnostics.json")
+        with open(diagnostics_path, 'w') as f:
+            f.write(timings.to_json())
+        written.append(diagnostics_path)
+
+    return(written, result.unknown_destinations, result.duplicate_exit_keys)
+
+
+# Function that appends the input files that aren't in the incremental state yet, writes the report and saves the state
+# (a monthly run can be pointed at the whole directory of exports, only the new month is processed)
+# (the incremental state keeps only the columns performance() uses, so it can only be split by fiscal year)
+def update_incremental_report(state_path, paths, output_dir, charts=True, backend=None, group_by=None, coc_title=None, export=None):
+    from SJCoC_Ingest import file_fingerprint
+    from SJCoC_Incremental import IncrementalReport
+
+    report = IncrementalReport.load(state_path) if os.path.exists(state_path) else IncrementalReport(backend)
+    if backend is not None:
+        report.backend = backend
+
+    keys = [file_fingerprint(path) for path in paths]
+    new = [(path, key) for path, key in zip(paths, keys) if key not in report.files]
+    if new:
+        df_entry, df_exit = read_report_data([path for path, key in new])
+        report.append(df_entry, df_exit, files=[key for path, key in new])
+    if report.clean is None:
+        raise ValueError("the report has no data yet")
+
+    # The state is only saved once the report was built from it
+    result = report.result()
+    written = write_report(os.path.splitext(os.path.basename(state_path))[0], result, output_dir, charts, group_by, coc_title, report.backend, export)
+    report.save(state_path)
+
+    return(written, result.unknown_destinations, result.duplicate_exit_keys, len(new), len(paths) - len(new))
+
+
+def main(argv=None):
+    from SJCoC_Export import EXPORT_FORMATS
+
+    parser = argparse.ArgumentParser(description="Generate SJCoC Q23c performance reports from HMIS workbooks without the streamlit app.")
+    parser.add_argument('inputs', nargs='+', help="workbooks, CSV files, snapshots (.zip), directories or glob patterns")
+    parser.add_argument('-o', '--output', default='.', help="directory the reports are written to (default: current directory)")
+    parser.add_argument('--combine', action='store_true', help="build one report over all input files instead of one per workbook")
+    parser.add_argument('--no-charts', action='store_true', help="skip the charts pdf and only write the excel reports")
+    parser.add_argument('--backend', default=None, choices=['pandas', 'polars'], help="compute backend that cleans the data and counts the households (default: pandas, or the SJCOC_BACKEND environment variable)")
+    parser.add_argument('--state', default=None, help="incremental state file: input files not in the state yet are appended to it, "
+                                                      "and one report over all of its files is written (named after the state file)")
+    parser.add_argument('--group-by', default=None, metavar='COLUMN', help="also write the report split by an Entry sheet column (ie. a project or agency column), "
+                                                                          "by 'Fiscal Year' of the exit date or by 'Source File', one sheet per slice")
+    parser.add_argument('--coc', default=None, help="CoC named in the report titles (default: CA-511: Central Valley Housing)")
+    parser.add_argument('--diagnostics', action='store_true', help="also write the wall time, rows and memory of every stage of each report as json")
+    parser.add_argument('--memory-budget', default=None, metavar='MB', help="memory (MB, or 'auto' for most of the container's memory) each report may use, "
+                                                                               "data that doesn't fit is cleaned in groups of households (default: the SJCOC_MEMORY_BUDGET_MB environment variable, or no budget)")
+    parser.add_argument('--export-clean', default=None, metavar='FORMAT', choices=EXPORT_FORMATS, help=f"also write the cleaned row level data (Age, Household Type, "
+                                                                                                      f"Destination Type of every enrollment) as {', '.join(EXPORT_FORMATS)}")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--render-processes', type=int, default=None, metavar='N', help="kaleido (chromium) processes each worker renders the charts in at once, "
+                                                                                       "every one kept running takes ~100 MB (default: 1 when several workers run, "
+                                                                                       "else the SJCOC_RENDER_PROCESSES environment variable or up to 4)")
+    args = parser.parse_args(argv)
+
+    paths = find_inputs(args.inputs)
+    if not paths:
+        parser.error("no input files found")
+    if args.render_processes is not None and args.render_processes < 1:
+        parser.error("--render-processes must be at least 1")
+    if args.state:
+        if args.group_by not in (None, 'Fiscal Year'):
+            parser.error("an incremental report can only be split by 'Fiscal Year'")
+        os.makedirs(args.output, exist_ok=True)
+        if args.render_processes and not args.no_charts:
+            from SJCoC_Charts import set_render_processes
+            set_render_processes(args.render_processes)
+        try:
+            written, unknown_destinations, duplicate_exit_keys, appended, skipped = update_incremental_report(args.state, paths, args.output, not args.no_charts,
+                                                                                                              args.backend, args.group_by, args.coc, args.export_clean)
+        except (ValueError, KeyError) as e:
+            print(f"FAILED ({e})", file=sys.stderr)
+            return(1)
+        print(f"appended {appended} new files to {args.state} ({skipped} were already in it)")
+        print(f"wrote {', '.join(written)}")
+        if duplicate_exit_keys:
+            print(f"{duplicate_exit_keys} duplicate exit records of the same enrollment were collapsed into one")
+        if unknown_destinations:
+            print(f"destinations left out of the report: {'; '.join(unknown_destinations)}")
+        return(0)
+    try:
+        groups = report_groups(paths, args.combine)
+    except ValueError as e:
+        parser.error(str(e))
+    os.makedirs(args.output, exist_ok=True)
+
+    # Loading the compute core before the pool starts lets forked workers share it instead of importing it again
+    import SJCoC_Pipeline
+
+    workers = args.workers or min(len(groups), os.cpu_count() or 1)
+    # Every worker keeps its own kaleido processes running, several workers render in one each unless told otherwise
+    render_processes = args.render_processes or (1 if workers > 1 else None)
+    pool_options = {}
+    if render_processes and not args.no_charts:
+        from SJCoC_Charts import set_render_processes
+        pool_options = {'initializer': set_render_processes, 'initargs': (render_processes,)}
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers, **pool_options) as pool:
+        futures = [(name, pool.submit(build_report, name, group, args.output, not args.no_charts, args.backend, args.group_by, args.coc, args.diagnostics, args.memory_budget, args.export_clean)) for name, group in groups]
+        for name, future in futures:
+            try:
+                written, unknown_destinations, duplicate_exit_keys = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{name}: FAILED ({e})", file=sys.stderr)
+                continue
+            print(f"{name}: wrote {', '.join(written)}")
+            if duplicate_exit_keys:
+                print(f"{name}: {duplicate_exit_keys} duplicate exit records of the same enrollment were collapsed into one")
+            if unknown_destinations:
+                print(f"{name}: destinations left out of the report: {'; '.join(unknown_destinations)}")
+
+    print(f"{len(groups) - failed} of {len(groups)} reports written to {args.output}")
+    return(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
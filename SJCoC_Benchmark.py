@@ -0,0 +1,228 @@
+# Benchmarks of the report stages on synthetic data (see SJCoC_Synthetic.py), to tell whether a change makes the report faster or slower
+# Every run is appended to a results file, and compared with the previous run of the same stage and scale
+#
+# Usage:
+#   python SJCoC_Benchmark.py                                  (10k and 100k enrollments, every stage)
+#   python SJCoC_Benchmark.py --scales 1000000 --format csv --stages ingest performance
+#   python SJCoC_Benchmark.py --fail-on-regression             (exit code 1 when a stage got slower than the threshold)
+
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+# Stages that are timed, in the order the report runs them
+BENCHMARK_STAGES = ['ingest', 'performance', 'chart_aggregates', 'worksheet', 'line_plots', 'sankey', 'pdf']
+
+# Number of enrollments benchmarked by default
+DEFAULT_SCALES = [10000, 100000]
+
+# File the results of every run are appended to (one json record per line)
+RESULTS_FILE = 'benchmark_results.jsonl'
+
+# A stage that takes this much longer than in the previous run is reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+# Attributes of the Sankey diagram the app draws by default
+SANKEY_COLUMNS = ['Race', 'Destination Type', 'Destination']
+
+
+# Function that runs a stage repeats times and returns its result, its fastest and median time in seconds
+# and the peak memory (MB) python allocated while it ran once more with tracemalloc (slower, so it isn't timed)
+def measure(stage, repeats=3, memory=True):
+    times = []
+    for i in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        result = stage()
+        times.append(time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            stage()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        finally:
+            tracemalloc.stop()
+    times.sort()
+    return(result, times[0], times[len(times) // 2], peak_mb)
+
+
+# Function that writes the synthetic input files of one scale (not timed), xlsx workbooks or gzipped CSV files
+def write_inputs(enrollments, directory, file_format='xlsx', seed=0):
+    from SJCoC_Synthetic import synthetic_frames, write_workbooks, write_csvs
+
+    d_entry, d_exit = synthetic_frames(enrollments, seed)
+    if file_format == 'csv':
+        return(write_csvs(d_entry, d_exit, directory, f"synthetic_{enrollments}"))
+    return(write_workbooks(d_entry, d_exit, directory, f"synthetic_{enrollments}"))
+
+
+# Function that builds the stages of one scale, each takes the results of the stages before it
+# Returns a list of (stage name, function), a stage whose libraries aren't installed is given as (stage name, reason it's skipped)
+def benchmark_stages(paths, backend=None):
+    import pandas as pd
+    from SJCoC_Ingest import read_uploads, normalize_sheet, ENTRY_COLUMNS, EXIT_COLUMNS
+    from SJCoC_Pipeline import performance, chart_aggregates
+    from SJCoC_Worksheet_Format import to_excel
+    from SJCoC_Charts import line_plots, SankeyDiagram, report_figures, charts_pdf
+
+    data = {}
+
+    # Reading the uploads the way the app does: every file in a worker process, then one normalized frame per sheet
+    # (the peak memory only counts this process, the memory the workers allocate while parsing several files isn't seen)
+    def ingest():
+        d_entry, d_exit = read_uploads(paths)
+        data['entry'] = normalize_sheet(pd.concat(d_entry).reset_index(drop=True), ENTRY_COLUMNS)
+        data['exit'] = normalize_sheet(pd.concat(d_exit).reset_index(drop=True), EXIT_COLUMNS)
+
+    def run_performance():
+        data['clean'], data['table'], unknown_destinations, duplicate_exit_keys = performance(data['entry'], data['exit'], backend)
+
+    def run_chart_aggregates():
+        data['charts'] = chart_aggregates(data['clean'], data['table'])
+
+    stages = [('ingest', ingest), ('performance', run_performance), ('chart_aggregates', run_chart_aggregates),
+              ('worksheet', lambda: to_excel(data['table']))]
+    try:
+        import plotly
+    except ImportError:
+        return(stages + [(stage, "plotly is not installed") for stage in ('line_plots', 'sankey', 'pdf')])
+    stages += [('line_plots', lambda: line_plots(data['charts']['move_in'])),
+               ('sankey', lambda: SankeyDiagram(data['clean'], SANKEY_COLUMNS))]
+    try:
+        import kaleido, fpdf
+    except ImportError:
+        return(stages + [('pdf', "kaleido or fpdf is not installed")])
+    return(stages + [('pdf', lambda: charts_pdf(report_figures(data['charts'])))])
+
+
+# Function that gives the commit the benchmarked code is at (None outside of a git checkout)
+def git_commit():
+    try:
+        return(subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return(None)
+
+
+# Function that describes where a run was made, results are only comparable between runs on the same machine and libraries
+def run_environment():
+    import numpy as np
+    import pandas as pd
+    return({'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'system': platform.system(), 'cpus': os.cpu_count()})
+
+
+# Function that runs the benchmarks of every scale and returns the record of the run
+def run_benchmarks(scales=DEFAULT_SCALES, stages=BENCHMARK_STAGES, file_format='xlsx', repeats=3, memory=True, backend=None, seed=0, log=print):
+    record = {'time': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(), 'environment': run_environment(),
+              'format': file_format, 'backend': backend, 'repeats': repeats, 'results': []}
+
+    for enrollments in scales:
+        with tempfile.TemporaryDirectory() as directory:
+            log(f"{enrollments} enrollments: writing the synthetic {file_format} files")
+            paths = write_inputs(enrollments, directory, file_format, seed)
+            for stage, run in benchmark_stages(paths, backend):
+                # Stages that aren't benchmarked still run once, the later stages need their results
+                if isinstance(run, str):
+                    if stage in stages:
+                        log(f"  {stage:<17} skipped ({run})")
+                        record['results'].append({'scale': enrollments, 'stage': stage, 'skipped': run})
+                    continue
+                if stage not in stages:
+                    run()
+                    continue
+                result, best, median, peak_mb = measure(run, repeats, memory)
+                log(f"  {stage:<17} {best:9.3f}s (median {median:.3f}s)" + (f"  peak {peak_mb:9.1f} MB" if peak_mb is not None else ""))
+                record['results'].append({'scale': enrollments, 'stage': stage, 'seconds': best, 'median_seconds': median, 'peak_mb': peak_mb})
+    return(record)
+
+
+# Function that loads the records of the earlier runs from a results file
+def load_results(path):
+    if not os.path.exists(path):
+        return([])
+    with open(path) as f:
+        return([json.loads(line) for line in f if line.strip()])
+
+
+# Function that appends the record of a run to a results file
+def save_results(record, path):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+# Function that compares every stage of a run with the latest earlier run of the same stage, scale and input format
+# Returns a list of (scale, stage, seconds, previous seconds, change, peak MB, previous peak MB, regression)
+def compare_results(record, previous_records, threshold=REGRESSION_THRESHOLD):
+    comparison = []
+    for result in record['results']:
+        if 'seconds' not in result:
+            continue
+        previous = None
+        for old in reversed(previous_records):
+            if old.get('format') != record['format'] or old.get('backend') != record['backend']:
+                continue
+            previous = next((r for r in old['results'] if r['scale'] == result['scale'] and r['stage'] == result['stage'] and 'seconds' in r), None)
+            if previous is not None:
+                break
+        if previous is None:
+            comparison.append((result['scale'], result['stage'], result['seconds'], None, None, result['peak_mb'], None, False))
+            continue
+        change = result['seconds'] / previous['seconds'] - 1 if previous['seconds'] else 0.0
+        comparison.append((result['scale'], result['stage'], result['seconds'], previous['seconds'], change,
+                           result['peak_mb'], previous.get('peak_mb'), change > threshold))
+    return(comparison)
+
+
+# Function that prints the comparison of a run with the earlier runs as a table
+def print_comparison(comparison):
+    print(f"{'scale':>10} {'stage':<17} {'seconds':>9} {'previous':>9} {'change':>8} {'peak MB':>9} {'previous':>9}")
+    for scale, stage, seconds, previous, change, peak_mb, previous_peak_mb, regression in comparison:
+        def number(value, fmt):
+            return(format(value, fmt) if value is not None else '-')
+        print(f"{scale:>10} {stage:<17} {seconds:>9.3f} {number(previous, '9.3f'):>9} {number(change, '+8.1%'):>8} "
+              f"{number(peak_mb, '9.1f'):>9} {number(previous_peak_mb, '9.1f'):>9}" + ("  REGRESSION" if regression else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SJCoC report stages on synthetic HMIS data.")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help=f"numbers of enrollments to benchmark (default: {DEFAULT_SCALES})")
+    parser.add_argument('--stages', nargs='+', default=BENCHMARK_STAGES, choices=BENCHMARK_STAGES, help="stages to time (default: all of them)")
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv'], help="format of the ingested files (default: xlsx)")
+    parser.add_argument('--backend', default=None, choices=['pandas', 'polars'], help="compute backend of performance() (default: pandas)")
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs of every stage, the fastest one is recorded (default: 3)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the extra run of every stage that measures its peak memory")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the synthetic data")
+    parser.add_argument('--results', default=RESULTS_FILE, help=f"file the results are appended to and compared with (default: {RESULTS_FILE})")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help=f"slowdown reported as a regression (default: {REGRESSION_THRESHOLD})")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with code 1 when a stage regressed")
+    args = parser.parse_args(argv)
+
+    # Loading the report modules before the ingest workers start lets forked workers share them
+    import SJCoC_Pipeline
+
+    previous_records = load_results(args.results)
+    record = run_benchmarks(args.scales, args.stages, args.format, args.repeats, not args.no_memory, args.backend, args.seed)
+    save_results(record, args.results)
+
+    comparison = compare_results(record, previous_records, args.threshold)
+    print()
+    print_comparison(comparison)
+    print(f"results appended to {args.results}")
+    if args.fail_on_regression and any(regression for *values, regression in comparison):
+        return(1)
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,479 @@
+# Functions that build the report charts (plotly figures) and the charts pdf from the pipeline's chart aggregates
+# plotly and fpdf take longer to import than the whole report takes to compute, so they are only imported when a chart is made
+
+import os
+import queue
+import threading
+from io import BytesIO
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from SJCoC_Diagnostics import StageTimings, timed, stage, start_stage, current_recorder, set_recorder
+
+# Environment variable holding the number of kaleido processes a process renders in (see RENDER_PROCESSES)
+RENDER_PROCESSES_ENV = 'SJCOC_RENDER_PROCESSES'
+
+# Kaleido processes (headless chromium, ~100 MB each) the figures of the charts pdf are rendered in at once, shared by every
+# report the process makes (see kaleido_scope). Every process making reports has its own, so the batch CLI's workers render
+# in one each (see set_render_processes)
+RENDER_PROCESSES = int(os.environ.get(RENDER_PROCESSES_ENV) or min(4, os.cpu_count() or 1))
+
+_idle_scopes = queue.SimpleQueue()                          # kaleido scopes not rendering, kept so their chromium starts once
+_scope_slots = threading.BoundedSemaphore(RENDER_PROCESSES)
+
+
+# Function that sets how many kaleido processes this process renders in at once, called before it renders anything
+def set_render_processes(processes):
+    global RENDER_PROCESSES, _scope_slots
+    RENDER_PROCESSES = max(1, int(processes))
+    _scope_slots = threading.BoundedSemaphore(RENDER_PROCESSES)
+
+
+# =============================================================================
+# Function that produces the line plot of indviduals/household counts with move-in dates
+# move_in holds the monthly counts computed by the pipeline (Month Year, Client Counts, Household Counts)
+@timed('figures 7 and 8: move-in line plots')
+def line_plots(move_in):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    # List of all month+year between first and last housing move in date (includes months without move-in dates too)
+    a = list(move_in['Month Year'])
+    unique_counts = list(move_in['Client Counts'])        # Contains the move-in date counts per unique id
+    household_counts = list(move_in['Household Counts'])  # Contains the movie-in date counts per household
+
+    # Client count plot(Unique Id)
+    fig = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.2,
+        specs=[[{"type": "scatter"}],
+               [{"type": "table"}]] )
+    fig.add_trace(
+        go.Scatter(
+            x=a,
+            y=unique_counts,
+            mode='lines',
+            line_color='#d55e00'),
+                   row=1, col=1)
+    fig.add_trace(
+        go.Table(header=dict(values=['Time', 'Client Counts']),
+         cells=dict(values=[a,unique_counts])),
+        row=2, col=1
+    )
+    fig.update_layout(
+        height=705,
+        showlegend=False,
+        title_text="Number of Individuals with a Move-In Date",
+    )
+    
+    # Household count plot (household Id)
+    fig2 = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.2,
+        specs=[[{"type": "scatter"}],
+               [{"type": "table"}]] )
+    fig2.add_trace(
+        go.Scatter(
+            x=a,
+            y=household_counts,
+            mode='lines',
+            line_color='#d55e00'),
+                   row=1, col=1)
+    fig2.add_trace(
+        go.Table(header=dict(values=['Time', 'Household Counts']),
+         cells=dict(values=[a,household_counts])),
+        row=2, col=1
+    )
+    fig2.update_layout(
+        height=705,
+        showlegend=False,
+        title_text="Number of Households with a Move-In Date",
+    )
+    
+    return(fig,fig2)
+
+
+
+# =============================================================================
+@timed('figure: sankey diagram')
+def SankeyDiagram(clean, cols=[]):
+    import plotly.express as px
+    import plotly.graph_objects as go
+    
+    # observed=True leaves out the combinations of categorical values that never occur in the data
+    df = clean.groupby(cols, observed=True).agg({'Unique ID':'count'}).reset_index()
+    df = df.set_axis([*df.columns[:-1], 'Total_Numbers'], axis=1)
+    value_col='Total_Numbers'
+    
+    colorPalette = px.colors.qualitative.D3
+    labelList = []
+    colorNumList = []
+    for catCol in cols:
+        labelListTemp =  list(set(df[catCol].values))
+        colorNumList.append(len(labelListTemp))
+        labelList = labelList + labelListTemp
+        
+    # Remove duplicates from labelList
+    labelList = list(dict.fromkeys(labelList))
+    
+    # Define colors based on number of levels
+    colorList = []
+    for index, colorNum in enumerate(colorNumList):
+        colorList = colorList + [colorPalette[index]]*colorNum
+        
+    # Transform df into a source-target pair
+    for i in range(len(cols)-1):
+        if i==0:
+            sourceTargetDf = df[[cols[i],cols[i+1],value_col]]
+            sourceTargetDf.columns = ['source','target','count']
+        else:
+            tempDf = df[[cols[i],cols[i+1],value_col]]
+            tempDf.columns = ['source','target','count']
+            sourceTargetDf = pd.concat([sourceTargetDf,tempDf])
+            
+        sourceTargetDf = sourceTargetDf.groupby(['source','target']).agg({'count':'sum'}).reset_index()
+        
+    # Add index for source-target pair
+    sourceTargetDf['source_indices'] = [labelList.index(i) for i in sourceTargetDf.source]
+    sourceTargetDf['target_indices'] = [labelList.index(j) for j in sourceTargetDf.target]
+    
+    fig = go.Figure(data=[go.Sankey(
+        # Define nodes
+        node = dict(
+          pad = 15,
+          thickness = 20,
+          line = dict(
+            color = "black",
+            width = 0.5
+          ),
+          label = labelList,
+          color = colorList
+        ),
+
+        # Add links
+        link = dict(
+          source = sourceTargetDf['source_indices'],
+          target = sourceTargetDf['target_indices'],
+          value = sourceTargetDf['count']
+        
+    ))])
+    fig.update_layout(title_text="Sankey Diagram", annotations=[
+    go.layout.Annotation(
+      showarrow=False,
+      text='** Counted by unique individuals',
+      xanchor='right',
+      x=1,
+      xshift=75,
+      yanchor='top',
+      y=-0.1,
+      font=dict(
+        size=12,
+        color="grey"
+      )
+    )])
+    return(fig)
+
+
+# =============================================================================
+# Function that creates the 8 report charts (sankey diagram not included) from the chart aggregates of a pipeline result
+def report_figures(charts):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    # Plot 1: Households per destination pie chart + table
+    figure = start_stage('figure 1: destinations pie chart')
+    des = charts['destinations']
+    
+    colors = ['#ffc000', '#F0F0F0', '#838588', '#CECFD1']
+
+    fig = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        specs=[[{"type": "pie"}],
+               [{"type": "table"}]])
+    fig.add_trace(
+        go.Pie(labels=des['Destination Type'],
+               values=des['Total']), 
+               row=1, col=1)
+    fig.add_trace(
+        go.Table(header=dict(values=['Destination', 'Household Count']),
+             cells=dict(values=[des['Destination Type'],des['Total']],align='center')), 
+                 row=2, col=1)
+    fig.update_traces(hoverinfo='label+percent',
+                      marker=dict(colors=colors),row=1, col=1)
+    fig.update_layout(
+        height=705,
+        width=705,
+        showlegend=True,
+        title_text="Household Destinations",
+        plot_bgcolor='white',
+        legend=dict(
+                orientation="h",
+                yanchor="top",
+                y= .525,
+                xanchor="center",
+                x=.5
+            )
+    )
+    
+    
+    figure.stop()
+    # ===================================================
+    # Plot 2: Creating household count horizontal bar chart  
+    figure = start_stage('figure 2: household types bar chart')
+    p = charts['household_types']
+    
+    fig2 = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        specs=[[{"type": "scatter"}],
+               [{"type": "table"}]] )
+    fig2.add_trace(
+        go.Bar(
+            x = p["Count"],
+            y = p["Household Type"],
+            orientation = 'h',
+            marker = dict(color= '#4472c4')),
+                   row=1, col=1)
+    fig2.add_trace(
+        go.Table(header=dict(values=['Household Type', 'Household Count']),
+        cells=dict(values=[p["Household Type"],p["Count"]])),
+        row=2, col=1
+    )
+    fig2.update_layout(
+        height=705,
+        showlegend=False,
+        title_text="Number of Households per Household Type",
+        plot_bgcolor='white'
+    )
+    fig2.update_xaxes(showline=True, linewidth=0.5, linecolor='lightgray')
+    fig2.update_yaxes(showline=True, linewidth=0.5, linecolor='lightgray')
+    
+    figure.stop()
+    # ===================================================
+    # Plot 3: Creating an age range vertical bar chart
+    figure = start_stage('figure 3: age ranges bar chart')
+    NumberofClients = list(charts['age_ranges']['Client Count'])
+    AgeRange = list(charts['age_ranges']['Age Range'])
+    
+    fig3 = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        specs=[[{"type": "scatter"}],
+               [{"type": "table"}]] )
+    fig3.add_trace(
+        go.Bar(
+            x = AgeRange,
+            y = NumberofClients,
+            marker = dict(color= '#ffc000')),
+                   row=1, col=1)
+    fig3.add_trace(
+        go.Table(header=dict(values=['Age Range', 'Client Count']),
+             cells=dict(values=[AgeRange,NumberofClients])),
+        row=2, col=1
+    )
+    fig3.update_layout(
+        height=705,
+        showlegend=False,
+        title_text="Number of Households per Household Type",
+        plot_bgcolor='white'
+    )
+
+    
+    figure.stop()
+    # ===================================================
+    # Plot 4: Creating the gender demographic pie chart
+    figure = start_stage('figure 4: gender pie chart')
+    gender = list(charts['Gender']['Gender'])
+    value = list(charts['Gender']['value'])
+    
+    colors = ['#ffc000', '#4472c4', '#d55e00', '#cc79a7', '#e69f00', '#56b4e9','#009e73', '#f0e442']
+ 
+    fig4 = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        specs=[[{"type": "pie"}],
+               [{"type": "table"}]])
+    fig4.add_trace(
+        go.Pie(labels=gender,
+               values=value), 
+               row=1, col=1)
+    fig4.add_trace(
+        go.Table(columnwidth = [300,100],
+                 header=dict(values=['Gender', 'Client Count']),
+                 cells=dict(values=[gender,value],align='center')), 
+                 row=2, col=1)
+    fig4.update_traces(hoverinfo='label+percent',
+                      marker=dict(colors=colors),row=1, col=1)
+    fig4.update_layout(
+        height=710,
+        width = 710,
+        showlegend=True,
+        title_text="Gender Demographics",
+        plot_bgcolor='white',
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.8)
+    )
+
+    
+    figure.stop()
+    # ===================================================
+    # Plot 5: Creating the race demographic pie chart
+    figure = start_stage('figure 5: race pie chart')
+    race = list(charts['Race']['Race'])
+    value = list(charts['Race']['value'])
+
+    fig5 = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        specs=[[{"type": "pie"}],
+               [{"type": "table"}]])
+    fig5.add_trace(
+        go.Pie(labels=race,
+               values=value), 
+               row=1, col=1)
+    fig5.add_trace(
+        go.Table(columnwidth = [300,100],
+                 header=dict(values=['Race', 'Client Count']),
+                 cells=dict(values=[race,value],align='center')), 
+                 row=2, col=1)
+    fig5.update_traces(hoverinfo='label+percent',
+                      marker=dict(colors=colors),row=1, col=1)
+    fig5.update_layout(
+        height=710,
+        width = 710,
+        showlegend=True,
+        title_text="Race Demographics",
+        plot_bgcolor='white',
+        legend=dict(
+        yanchor="top",
+        y=0.99,
+        xanchor="left",
+        x=0.8)
+    )
+    
+    figure.stop()
+    # ===================================================
+    # Plot 6: Creating a the ethnicity demographic pie chart
+    figure = start_stage('figure 6: ethnicity pie chart')
+    ethnicity = list(charts['Ethnicity']['Ethnicity'])
+    value = list(charts['Ethnicity']['value'])
+
+    fig6 = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        specs=[[{"type": "pie"}],
+               [{"type": "table"}]])
+    fig6.add_trace(
+        go.Pie(labels=ethnicity,
+               values=value), 
+               row=1, col=1)
+    fig6.add_trace(
+        go.Table(columnwidth = [300,100],
+                 header=dict(values=['Ethnicity', 'Client Count']),
+                 cells=dict(values=[ethnicity,value],align='center')), 
+                 row=2, col=1)
+    fig6.update_traces(hoverinfo='label+percent',
+                      marker=dict(colors=colors),row=1, col=1)
+    fig6.update_layout(
+        height=710,
+        width = 710,
+        showlegend=True,
+        title_text="Ethnicity Demographics",
+        plot_bgcolor='white',
+        legend=dict(
+        yanchor="top",
+        y=0.99,
+        xanchor="left",
+        x=0.8)
+    )
+    
+    
+    figure.stop()
+    # ===================================================
+    # Plot 7 and 8: Creating the line charts of individuals and households with Move-In date by calling our line_plot function we created above
+    fig7, fig8 = line_plots(charts['move_in'])
+
+    return([fig, fig2, fig3, fig4, fig5, fig6, fig7, fig8])
+
+
+# =============================================================================
+# Context manager that lends a kaleido scope (one chromium process) to a render, at most RENDER_PROCESSES are running at once
+# A kaleido scope renders one image at a time, so concurrent renders each need a scope of their own
+@contextmanager
+def kaleido_scope():
+    import plotly.io as pio
+    from kaleido.scopes.plotly import PlotlyScope
+
+    with _scope_slots:
+        try:
+            scope = _idle_scopes.get_nowait()
+        except queue.Empty:
+            # configured like plotly's own scope so the images are the ones fig.to_image() gives
+            default = pio.kaleido.scope
+            scope = PlotlyScope(plotlyjs=default.plotlyjs, mathjax=default.mathjax, topojson=default.topojson)
+            scope.default_width, scope.default_height, scope.default_scale = default.default_width, default.default_height, default.default_scale
+        try:
+            yield scope
+        finally:
+            _idle_scopes.put(scope)
+
+
+# Function that renders a figure as png bytes
+def render_png(fig):
+    try:
+        import kaleido.scopes.plotly
+    except ImportError:
+        return(fig.to_image(format="png"))   # kaleido 1.x renders every image in a browser of its own
+    with kaleido_scope() as scope:
+        return(scope.transform(fig, format="png"))
+
+
+# Function that renders figure n in a worker thread, returns its png bytes and the stage timings of the render (None: not recorded)
+# The recorders are per thread, so a worker times its render with a recorder of its own
+def render_figure(n, fig, record=False):
+    timings = set_recorder(StageTimings() if record else None)
+    try:
+        with stage(f'kaleido render of figure {n}'):
+            return(render_png(fig), timings)
+    finally:
+        set_recorder(None)
+
+
+# Function that renders the figures concurrently (RENDER_PROCESSES at a time), and returns their png bytes in the figures' order
+# The render of every figure is listed as a sub-stage of this one, in the figures' order
+@timed('kaleido render of the figures')
+def render_figures(figs):
+    recorder = current_recorder()
+    with ThreadPoolExecutor(max_workers=RENDER_PROCESSES) as pool:
+        rendered = list(pool.map(render_figure, range(1, len(figs) + 1), figs, [recorder is not None] * len(figs)))
+    if recorder is not None:
+        for image, timings in rendered:
+            recorder.add_stages(timings)
+    return([image for image, timings in rendered])
+
+
+# =============================================================================
+# Function that places the charts into a pdf file, one chart per pdf page, and returns the pdf as bytes
+# The figures are rendered in memory and handed to fpdf2 as file objects, nothing is written to disk (fpdf2 parses the pngs with
+# Pillow, fpdf 1.7.2 only read images from files and split their alpha channel a byte at a time)
+def charts_pdf(figs):
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    for png in render_figures(figs):
+        pdf.add_page() # creates a new pdf page each iteration
+        pdf.image(BytesIO(png), 10, 10, 180, 180) # Adjusts the chart size on the pdf
+
+    return(bytes(pdf.output()))
@@ -0,0 +1,68 @@
+# Vectorized date parsing and age calculation on whole columns of the Entry and Exit data
+
+import pandas as pd
+
+# Format of the text dates in the HMIS exports (ie. 03/24/2021)
+DATE_FORMAT = "%m/%d/%Y"
+
+# Date columns of the Entry and Exit sheets
+DATE_COLUMNS = ["Enrollment Start Date", "Enrollment Exit Date", "DOB", "Housing Move-In Date"]
+
+
+# Number of unreadable dates quoted in the error of parse_text_dates
+MAX_QUOTED_DATES = 5
+
+
+# Function that parses a column of text dates: in the HMIS format first (fast), then the dates written another way are parsed
+# one by one (ie. 2021-03-24 in a CSV saved by pandas), blank text is a missing date
+# Raises ValueError listing the dates that can't be read at all, rather than dropping their rows without a word
+def parse_text_dates(values):
+    parsed = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    missed = parsed.isna() & values.notna()
+    if not missed.any():
+        return(parsed)
+    missed &= values.astype(str).str.strip() != ''
+    parsed[missed] = pd.to_datetime(values[missed], errors='coerce')
+    unreadable = values[missed & parsed.isna()]
+    if len(unreadable) > 0:
+        examples = ', '.join(f"'{v}'" for v in unreadable.drop_duplicates().head(MAX_QUOTED_DATES))
+        raise ValueError(f"{len(unreadable)} dates in the '{values.name}' column could not be read (ie. {examples}), "
+                         f"dates are expected as mm/dd/yyyy")
+    return(parsed)
+
+
+# Function that converts a column of text dates and/or excel dates (Timestamps) to datetime64 (see parse_text_dates)
+def parse_dates(values):
+    values = pd.Series(values)
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return(values)
+
+    # Categorical columns only parse their distinct dates, the result is broadcast back through the category codes
+    if isinstance(values.dtype, pd.CategoricalDtype) and len(values.cat.categories) > 0:
+        dates = parse_dates(pd.Series(values.cat.categories, name=values.name)).to_numpy()
+        codes = values.cat.codes.to_numpy()
+        parsed = pd.Series(dates.take(codes, mode='clip'), index=values.index, name=values.name)
+        return(parsed.mask(codes == -1))   # code -1 marks a missing value
+
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind == 'string':
+        return(parse_text_dates(values))
+    if kind != 'mixed':
+        return(pd.to_datetime(values, errors='coerce'))
+
+    # A column mixing text and excel dates is parsed in two parts
+    is_text = values.map(lambda v: isinstance(v, str))
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]', name=values.name)
+    parsed[is_text] = parse_text_dates(values[is_text])
+    parsed[~is_text] = pd.to_datetime(values[~is_text], errors='coerce')
+    return(parsed)
+
+
+# Function that calculates the age (in whole years) at the exit date for every row at once
+# Like counting on a calendar, a year is only added once the birthday has been reached in the exit year
+def calculate_ages(dob, exit_date):
+    born = parse_dates(dob)
+    exit = parse_dates(exit_date)
+    birthday_not_reached = (exit.dt.month * 100 + exit.dt.day) < (born.dt.month * 100 + born.dt.day)
+    return(exit.dt.year - born.dt.year - birthday_not_reached)
@@ -0,0 +1,52 @@
+# HUD exit destinations grouped into the destination types of the Q23c performance report
+# Plain python only, so the categories can be imported without loading pandas
+
+# List of permanent housing categories
+permanent_category = ["Moved from one HOPWA funded project to HOPWA PH",
+                      "Owned by client, no ongoing housing subsidy",
+                      "Owned by client, with ongoing housing subsidy",
+                      "Rental by client, no ongoing housing subsidy",
+                      "Rental by client, with VASH housing subsidy",
+                      "Rental by client, with GPD TIP housing subsidy",
+                      "Rental by client, with other ongoing housing subsidy",
+                      "Permanent housing (other than RRH) for formerly homeless persons",
+                      "Staying or living with family, permanent tenure",
+                      "Staying or living with friends, permanent tenure",
+                      "Rental by client, with RRH or equivalent subsidy",
+                      "Rental by client, with HCV voucher (tenant or project based)",
+                      "Rental by client in a public housing unit"]
+
+# List of temporary housing categories
+temporary_category = ["Emergency shelter, including hotel or motel paid for with emergency shelter voucher, or RHY-funded Host Home shelter",
+                      "Moved from one HOPWA funded project to HOPWA TH",
+                      "Transitional housing for homeless persons (including homeless youth)",
+                      "Staying or living with family, temporary tenure (e.g. room, apartment or house)",
+                      "Staying or living with friends, temporary tenure (e.g. room, apartment or house)",
+                      "Place not meant for habitation (e.g., a vehicle, an abandoned building, bus / train / subway station / airport or anywhere outside)",
+                      "Safe Haven",
+                      "Hotel or motel paid for without emergency shelter voucher",
+                      "Host Home (non-crisis)"]
+
+# List of institutional setting housing categories
+institutional_setting_category = ["Foster care home or group foster care home",
+                                  "Psychiatric hospital or other psychiatric facility",
+                                  "Substance abuse treatment facility or detox center",
+                                  "Hospital or other residential non-psychiatric medical facility",
+                                  "Jail, prison, or juvenile detention facility",
+                                  "Long-term care facility or nursing home"]
+
+# List of other housing categories
+other_category= ["Residential project or halfway house with no homeless criteria",
+                 "Deceased",
+                 "Other",
+                 "Client Doesn't Know/Client Refused",
+                 "Data Not Collected (no exit interview completed)"]
+
+# Destination types in the order they appear in the performance report, each with its list of destinations
+destination_categories = [("Permanent Destinations", permanent_category),
+                          ("Temporary Destinations", temporary_category),
+                          ("Institutional Settings", institutional_setting_category),
+                          ("Other Destinations", other_category)]
+
+# Lookup table of every destination to its destination type, built once from the category lists above
+destination_types = {dest: dest_type for dest_type, category in destination_categories for dest in category}
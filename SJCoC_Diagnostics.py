@@ -0,0 +1,125 @@
+# Per-stage diagnostics: wall time, row counts and memory (RSS) of every stage of the report, to see where a slow upload spends its time
+# The stages only record when a recorder is active in the current thread (streamlit serves every session from its own thread),
+# otherwise they cost one attribute lookup
+
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+_active = threading.local()
+
+
+# Function that gives the resident memory of this process in MB (None when psutil isn't installed)
+def rss_mb():
+    try:
+        import psutil
+    except ImportError:
+        return(None)
+    return(psutil.Process().memory_info().rss / 1024**2)
+
+
+# One stage being timed, its record is added when it starts (so stages are listed in the order they ran) and filled in by stop()
+class Stage:
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.rows = None
+        self.depth = recorder.depth
+        self.record = {'stage': name, 'depth': self.depth, 'seconds': None, 'rows': None, 'rss_mb': None, 'rss_delta_mb': None}
+        recorder.stages.append(self.record)
+        recorder.depth += 1
+        self.rss_before = rss_mb()
+        self.start = time.perf_counter()
+
+    def stop(self, rows=None):
+        seconds = time.perf_counter() - self.start
+        rss_after = rss_mb()
+        self.recorder.depth = self.depth
+        self.record.update(seconds=seconds, rows=self.rows if rows is None else rows, rss_mb=rss_after,
+                           rss_delta_mb=None if rss_after is None else rss_after - self.rss_before)
+
+
+# A stage when nothing is recording
+class NoStage:
+    rows = None
+
+    def stop(self, rows=None):
+        pass
+
+
+# Records the stages run while it is the active recorder of the thread
+class StageTimings:
+
+    def __init__(self):
+        self.stages = []     # one record per stage, in the order they started (a stage's sub-stages follow it one level deeper)
+        self.depth = 0       # nesting level of the next stage
+
+    # Function that gives the stages as a dataframe for the diagnostics panel, sub-stages are indented beneath their stage
+    def frame(self):
+        import pandas as pd
+        frame = pd.DataFrame(self.stages, columns=['stage', 'depth', 'seconds', 'rows', 'rss_mb', 'rss_delta_mb'])
+        frame['stage'] = ['    ' * s['depth'] + s['stage'] for s in self.stages]
+        return(frame.drop(columns='depth'))
+
+    # Function that adds the stages another recorder timed (ie. in a worker thread) as sub-stages of the stage running now
+    def add_stages(self, timings):
+        for record in timings.stages:
+            self.stages.append(dict(record, depth=record['depth'] + self.depth))
+
+    # Function that exports the stages as json, with the total time of the outermost stages and the largest RSS seen
+    def to_json(self):
+        rss = [s['rss_mb'] for s in self.stages if s['rss_mb'] is not None]
+        return(json.dumps({'total_seconds': sum(s['seconds'] or 0 for s in self.stages if s['depth'] == 0),
+                           'peak_rss_mb': max(rss) if rss else None, 'stages': self.stages}, indent=2))
+
+
+# Function that makes a recorder the active one of this thread (None stops recording), and returns it
+def set_recorder(recorder):
+    _active.recorder = recorder
+    return(recorder)
+
+
+def current_recorder():
+    return(getattr(_active, 'recorder', None))
+
+
+# Context manager that records the stages run inside it, ie. with recording() as timings: ...
+@contextmanager
+def recording(recorder=None):
+    previous = current_recorder()
+    recorder = set_recorder(recorder or StageTimings())
+    try:
+        yield recorder
+    finally:
+        set_recorder(previous)
+
+
+# Function that starts timing a stage, for stages that aren't a block of their own (call stop() on the result)
+def start_stage(name):
+    recorder = current_recorder()
+    if recorder is None:
+        return(NoStage())
+    return(Stage(recorder, name))
+
+
+# Context manager that times the block inside it as a stage, the block can set the stage's row count (ie. s.rows = len(d))
+@contextmanager
+def stage(name):
+    s = start_stage(name)
+    try:
+        yield s
+    finally:
+        s.stop()
+
+
+# Decorator that times every call of a function as a stage
+def timed(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return(function(*args, **kwargs))
+        return(wrapper)
+    return(decorator)
@@ -0,0 +1,85 @@
+# Export of the cleaned enrollment data (one row per client enrollment with its Age, Household Type and Destination Type), for audits
+# The data is written in chunks straight to the output, so an export never holds a second full copy of it (ie. multi-million rows)
+
+import io
+import gzip
+from SJCoC_Diagnostics import timed
+
+# Formats the cleaned data can be exported to, and the extension of their files
+EXPORT_FORMATS = ['xlsx', 'csv', 'parquet']
+EXPORT_EXTENSIONS = {'xlsx': '.xlsx', 'csv': '.csv', 'parquet': '.parquet'}
+
+# Rows converted and written at a time
+EXPORT_CHUNK_ROWS = 100000
+
+# An excel sheet holds at most this many rows (the header included), larger data continues on another sheet
+EXCEL_MAX_ROWS = 1048576
+CLEAN_SHEET = 'Clean data'
+
+
+# Function that splits a dataframe into chunks of rows (slices of it, not copies)
+def row_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+# Function that writes the cleaned data as excel sheets, 'Clean data', 'Clean data (2)'... when it has more rows than a sheet holds
+def export_xlsx(clean, target):
+    from SJCoC_Worksheet_Format import ReportWorkbook
+
+    book = ReportWorkbook(target)
+    for start in range(0, max(len(clean), 1), EXCEL_MAX_ROWS - 1):
+        book.add_data_sheet(clean.iloc[start:start + EXCEL_MAX_ROWS - 1], CLEAN_SHEET)
+    book.close()
+
+
+# Function that writes the cleaned data as CSV, a path ending in .gz is gzipped
+def export_csv(clean, target, chunk_rows=EXPORT_CHUNK_ROWS):
+    if isinstance(target, str):
+        f = gzip.open(target, 'wt', newline='') if target.endswith('.gz') else open(target, 'w', newline='')
+    else:
+        f = io.TextIOWrapper(target, encoding='utf-8', newline='')
+    try:
+        clean.iloc[:0].to_csv(f, index=False)
+        for chunk in row_chunks(clean, chunk_rows):
+            chunk.to_csv(f, header=False, index=False)
+    finally:
+        if isinstance(target, str):
+            f.close()
+        else:
+            f.flush()
+            f.detach()      # leaves the file object open for the caller
+
+
+# Function that writes the cleaned data as a Parquet file, one row group per chunk
+def export_parquet(clean, target, chunk_rows=EXPORT_CHUNK_ROWS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # the schema is taken from the columns' types, text columns have no type until they hold a value so they are stored as strings
+    schema = pa.Schema.from_pandas(clean.iloc[:0], preserve_index=False)
+    schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema], metadata=schema.metadata)
+    with pq.ParquetWriter(target, schema, compression='zstd') as writer:
+        for chunk in row_chunks(clean, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+# Function that exports the cleaned data (result.clean of run_pipeline) to a path or a writable binary file object
+# file_format: one of EXPORT_FORMATS
+@timed('clean data export')
+def export_clean(clean, target, file_format):
+    if file_format == 'xlsx':
+        export_xlsx(clean, target)
+    elif file_format == 'csv':
+        export_csv(clean, target)
+    elif file_format == 'parquet':
+        export_parquet(clean, target)
+    else:
+        raise ValueError(f"The cleaned data can be exported as {', '.join(EXPORT_FORMATS)}, not '{file_format}'")
+
+
+# Function that returns the exported cleaned data as bytes (used for the streamlit download link)
+def clean_export_bytes(clean, file_format):
+    output = io.BytesIO()
+    export_clean(clean, output, file_format)
+    return(output.getvalue())
@@ -0,0 +1,223 @@
+# Incremental report updates: an appended export (ie. the new month) only reprocesses the households it touches
+#
+# Every value of the cleaned data depends only on the rows of its own household: the Household ID is part of the enrollment
+# key, and move-in dates and household composition are resolved per household. So the touched households are cleaned again on
+# their own, and their old contribution to every count is swapped for the new one. The counts are kept per distinct key
+# (ie. per destination, household type and household), so distinct counts like the Q23c households stay exact.
+
+import hashlib
+import pickle
+from collections import Counter
+import numpy as np
+import pandas as pd
+from SJCoC_Ingest import concat_sheet_chunks, ENTRY_COLUMNS, EXIT_COLUMNS
+from SJCoC_Backends import get_backend, compact_clean
+from SJCoC_Destinations import destination_types
+from SJCoC_Pipeline import (PipelineResult, q23c_table, table_aggregates, age_range_counts, demographic_table,
+                            monthly_move_in_counts, age_range_labels)
+
+# Version of the saved incremental state, a state saved by another version has to be rebuilt from its files
+INCREMENTAL_STATE_VERSION = 2
+
+# Demographic columns with a pie chart
+demographic_columns = ['Gender', 'Race', 'Ethnicity']
+
+
+# Function that counts the value combinations of the given columns, missing values are counted under None
+# (dates are counted by their nanosecond value, building a Timestamp object per row is slow; pandas 2 keeps dates in
+#  second or millisecond units too, so they are cast to nanoseconds before taking their value)
+def key_counts(df, columns):
+    values = []
+    for col in columns:
+        if pd.api.types.is_datetime64_dtype(df[col]):
+            values.append(pd.Series(df[col].to_numpy().astype('datetime64[ns]').view('int64'), index=df.index).astype(object).where(df[col].notna(), None))
+        else:
+            values.append(df[col].astype(object).where(df[col].notna(), None))
+    if len(columns) == 1:
+        return(Counter(values[0]))
+    return(Counter(zip(*values)))
+
+
+# Function that computes what a set of cleaned rows contributes to the report, as counts per distinct key
+def household_contributions(clean):
+    # Heads of household with a move-in date and a destination type, the rows the Q23c table counts
+    heads = clean[(clean['Housing Move-In Date'].notna()) & (clean['Relationship to Head of Household']=='Self (head of household)')
+                  & (clean['Destination Type'].notna())]
+    move_in = clean[clean['Housing Move-In Date'].notna()]
+
+    contributions = {'q23c': key_counts(heads, ['Destination', 'Household Type', 'Household ID']),
+                     'heads': Counter({'heads': len(heads)}),
+                     'ages': Counter(age_range_counts(clean['Age']).to_dict()),
+                     'client_moves': key_counts(move_in, ['Unique ID', 'Housing Move-In Date']),
+                     'household_moves': key_counts(move_in, ['Household ID', 'Housing Move-In Date']),
+                     'destinations': key_counts(clean, ['Destination'])}
+    for col in demographic_columns:
+        contributions[col] = key_counts(clean, [col])
+    return(contributions)
+
+
+# Incremental state of one report: the deduplicated rows of every append, the cleaned data and the counts behind the report
+class IncrementalReport:
+
+    # Counts of distinct keys, and the key -> group function their distinct counts are kept for
+    # (ie. q23c counts each (destination, household type, household) row, q23c_households the distinct households per (destination, household type))
+    distinct_counts = {'q23c': ('q23c_households', lambda key: key[:2]),
+                       'client_moves': ('client_dates', lambda key: key[1]),
+                       'household_moves': ('household_dates', lambda key: key[1])}
+
+    def __init__(self, backend=None):
+        self.version = INCREMENTAL_STATE_VERSION
+        self.backend = backend           # name of the compute backend (None for the default one)
+        self.files = []                  # fingerprints of the files appended so far, in order
+        self.entry_parts = []            # the new (deduplicated) Entry and Exit rows of every append
+        self.exit_parts = []
+        self.clean = None                # cleaned data of every household
+        self.counts = {}                 # counts per distinct key (see household_contributions)
+        self.duplicate_exit_keys = 0
+        self._result = None
+
+    # Function that selects the rows of the touched households (and the rows without a Household ID when any were touched)
+    @staticmethod
+    def touched_rows(df, household_ids, missing_ids):
+        mask = df['Household ID'].isin(household_ids).to_numpy()
+        if missing_ids:
+            mask |= df['Household ID'].isna().to_numpy()
+        return(mask)
+
+    # Function that adds removed/added counts to the running counts, keeping the distinct counts of the grouped keys up to date
+    def update_counts(self, key, removed, added):
+        distinct, group = self.distinct_counts.get(key, (None, None))
+
+        # The first append takes its counts as they are
+        if not self.counts.get(key) and not removed:
+            self.counts[key] = Counter(added)
+            if distinct is not None:
+                self.counts[distinct] = Counter(map(group, added))
+            return
+
+        counts = self.counts.setdefault(key, Counter())
+        if distinct is not None:
+            distinct = self.counts.setdefault(distinct, Counter())
+        for k, n in removed.items():
+            counts[k] -= n
+            if counts[k] == 0:
+                del counts[k]
+                if distinct is not None:
+                    distinct[group(k)] -= 1
+                    if distinct[group(k)] == 0:
+                        del distinct[group(k)]
+        for k, n in added.items():
+            if distinct is not None and counts[k] == 0:
+                distinct[group(k)] += 1
+            counts[k] += n
+
+    # Function that appends the Entry and Exit data of new files (either may be None, ie. for a CSV file holding only one sheet)
+    # files: fingerprints of the appended files, recorded so they aren't appended twice
+    def append(self, d_entry, d_exit, files=()):
+        if d_entry is None:
+            d_entry = pd.DataFrame(columns=ENTRY_COLUMNS)
+        if d_exit is None:
+            d_exit = pd.DataFrame(columns=EXIT_COLUMNS)
+        d_entry = d_entry[ENTRY_COLUMNS]
+        d_exit = d_exit[EXIT_COLUMNS]
+        self.files.extend(files)
+
+        # Households the new rows belong to, duplicate rows can only come from the same household
+        new_ids = pd.concat([d_entry['Household ID'].astype(object), d_exit['Household ID'].astype(object)])
+        household_ids = new_ids.dropna().unique()
+        missing_ids = bool(new_ids.isna().any())
+
+        # Every row the touched households had so far, followed by the new rows
+        old_entry = [part[self.touched_rows(part, household_ids, missing_ids)] for part in self.entry_parts]
+        old_exit = [part[self.touched_rows(part, household_ids, missing_ids)] for part in self.exit_parts]
+        entry = concat_sheet_chunks(old_entry + [d_entry], ENTRY_COLUMNS)
+        exit = concat_sheet_chunks(old_exit + [d_exit], EXIT_COLUMNS)
+
+        # Only the rows that aren't already stored are kept (the stored rows of every household are unique already)
+        old_entry_rows = sum(len(part) for part in old_entry)
+        old_exit_rows = sum(len(part) for part in old_exit)
+        new_entry = entry.iloc[old_entry_rows:][~entry.duplicated().to_numpy()[old_entry_rows:]]
+        new_exit = exit.iloc[old_exit_rows:][~exit.duplicated().to_numpy()[old_exit_rows:]]
+        if new_entry.empty and new_exit.empty:
+            return(self)     # nothing that isn't in the report already
+        self.entry_parts.append(new_entry.reset_index(drop=True))
+        self.exit_parts.append(new_exit.reset_index(drop=True))
+
+        # Cleaning the touched households again with all of their rows
+        backend = get_backend(self.backend)
+        clean, unknown_destinations, duplicate_exit_keys = backend.clean(entry, exit)
+
+        # The exit records the touched households had collapsed before this append
+        old_exit = exit.iloc[:old_exit_rows]
+        common_columns = [col for col in ENTRY_COLUMNS if col in EXIT_COLUMNS]
+        old_duplicate_exit_keys = int(old_exit[common_columns].duplicated(keep='last').sum())
+        self.duplicate_exit_keys += duplicate_exit_keys - old_duplicate_exit_keys
+
+        # Swapping the touched households' old cleaned rows and counts for the new ones
+        if self.clean is None:
+            removed, kept = {}, []
+        else:
+            touched = self.touched_rows(self.clean, household_ids, missing_ids)
+            removed, kept = household_contributions(self.clean[touched]), [self.clean[~touched]]
+        added = household_contributions(clean)
+        for key in added:
+            self.update_counts(key, removed.get(key, {}), added[key])
+        self.clean = compact_clean(concat_sheet_chunks(kept + [clean], list(clean.columns)))
+
+        self._result = None
+        return(self)
+
+    # Function that turns counts per move-in date (counted by nanosecond value) into a series indexed by date
+    @staticmethod
+    def date_counts(counts):
+        return(pd.Series(list(counts.values()), index=pd.to_datetime(list(counts.keys()), unit='ns'), dtype='int64'))
+
+    # Function that lays out the report from the running counts, the same result run_pipeline gives for all of the appended data
+    def result(self):
+        if self._result is not None:
+            return(self._result)
+        if self.clean is None:
+            raise ValueError("Nothing has been appended to the report yet")
+
+        # Distinct households per destination and household type
+        households = self.counts['q23c_households']
+        if households:
+            household_counts = pd.Series(households).unstack(fill_value=0)
+        else:
+            household_counts = pd.DataFrame()
+        performance_table = q23c_table(household_counts, self.counts['heads']['heads'])
+
+        charts = table_aggregates(performance_table)
+        ages = self.counts['ages']
+        charts['age_ranges'] = pd.DataFrame({'Age Range': age_range_labels + ['No Answer'],
+                                             'Client Count': [ages[label] for label in age_range_labels + ['No Answer']]})
+
+        # Demographic values in sorted order with the missing values last, like the categoricals of the cleaned data
+        for col in demographic_columns:
+            counts = self.counts[col]
+            values = sorted(v for v in counts if v is not None) + ([None] if None in counts else [])
+            charts[col] = demographic_table(col, pd.Series([counts[v] for v in values], index=[np.nan if v is None else v for v in values], dtype='int64'))
+
+        charts['move_in'] = monthly_move_in_counts(self.date_counts(self.counts['client_dates']), self.date_counts(self.counts['household_dates']))
+
+        unknown_destinations = sorted(str(dest) for dest in self.counts['destinations'] if dest is not None and dest not in destination_types)
+
+        fingerprint = hashlib.blake2b(''.join(self.files).encode(), digest_size=20).hexdigest()
+        self._result = PipelineResult(fingerprint, self.clean, performance_table, charts, unknown_destinations, self.duplicate_exit_keys)
+        return(self._result)
+
+    # Function that saves the state to a file, so next month's run only appends the new export
+    def save(self, path):
+        self._result = None
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Function that loads a state saved by save()
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if getattr(state, 'version', None) != INCREMENTAL_STATE_VERSION:
+            raise ValueError(f"'{path}' was saved by another version of the report (state version {getattr(state, 'version', None)}, "
+                             f"expected {INCREMENTAL_STATE_VERSION}), please rebuild it from the original files")
+        return(state)
@@ -0,0 +1,336 @@
+# Functions that read the uploaded HMIS workbooks into Entry and Exit dataframes
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from pandas.api.types import union_categoricals
+from SJCoC_Dates import DATE_COLUMNS, parse_dates
+from SJCoC_Diagnostics import stage
+
+# Sheet names every uploaded workbook must contain
+ENTRY_SHEET = 'Entry data'
+EXIT_SHEET = 'Exit data'
+
+# The only attributes performance() uses from each sheet (our HMIS exports carry 60+ columns)
+ENTRY_COLUMNS = ["Unique ID", "Enrollment Start Date", "Enrollment Exit Date", "DOB", "Household ID", "Gender", "Race", "Ethnicity", "Relationship to Head of Household", "Housing Move-In Date"]
+EXIT_COLUMNS = ["Unique ID", "Enrollment Start Date", "Enrollment Exit Date", "DOB", "Household ID", "Gender", "Race", "Ethnicity", "Destination", "Specify Other Exit Destination"]
+ID_COLUMNS = ["Unique ID", "Household ID"]
+
+# Rows parsed from a CSV file at a time, only one chunk of raw text is held in memory at once
+CSV_CHUNK_ROWS = 100000
+
+
+# Function that streams the rows of a worksheet and keeps only the requested columns while reading
+def read_sheet_columns(wb, sheet_name, columns):
+    # A missing sheet or column is a problem with the upload, reported as ValueError like the other upload errors the app shows
+    if sheet_name not in wb.sheetnames:
+        raise ValueError(f"The workbook has no '{sheet_name}' sheet")
+
+    # A read_only sheet trusts the size its <dimension> tag states, which some exporters leave out or write wrong (ie. A1), so
+    # like pandas the size is reset and every row is read as far as its last cell (the rows then differ in length)
+    ws = wb[sheet_name]
+    ws.reset_dimensions()
+    rows = ws.iter_rows(values_only=True)
+
+    # Locating the requested columns in the header row (removing the tailing spaces behind the column names)
+    header = [str(c).strip() if c is not None else '' for c in next(rows, ())]
+    missing = [c for c in columns if c not in header]
+    if missing:
+        raise ValueError(f"The '{sheet_name}' sheet is missing the columns: {', '.join(missing)}")
+    indexes = [header.index(c) for c in columns]
+
+    # Only the projected values of each row are kept, each appended to its own column list, rows that are blank in all of them are skipped
+    values = {col: [] for col in columns}
+    appends = [(i, values[col].append) for col, i in zip(columns, indexes)]
+    width = max(indexes) + 1
+    for row in rows:
+        if len(row) < width:
+            row = row + (None,) * (width - len(row))    # the blank cells at the end of a row aren't read
+        if any(row[i] is not None for i in indexes):
+            for i, append in appends:
+                append(row[i])
+
+    # The frame is built column by column, without a list of row tuples for pandas to transpose
+    if not values[columns[0]]:
+        return(pd.DataFrame(columns=columns))
+    return(pd.DataFrame(values))
+
+
+# Function that puts an Entry or Exit sheet into the columns performance() expects with compact column types
+# Dates are parsed to datetime64, and text columns (ie. Gender, Race, Destination) that repeat a handful of long strings are stored as categoricals
+def normalize_sheet(df, columns):
+    df = df.rename(columns=lambda c: str(c).strip())     # removing the tailing spaces behind the column names
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"The data is missing the columns: {', '.join(missing)}")
+    normalized = {}
+    for col in columns:
+        values = df[col]
+        if col in DATE_COLUMNS:
+            values = parse_dates(values)
+        elif pd.api.types.infer_dtype(values, skipna=True) == 'string':
+            values = values.astype('category')
+        normalized[col] = values
+    # The dict is already in column order, passing columns= as well makes pandas copy every datetime column through python objects
+    return(pd.DataFrame(normalized))
+
+
+# Function that concatenates compact chunks of a sheet without turning their categorical columns back into strings
+def concat_sheet_chunks(chunks, columns):
+    if not chunks:
+        return(pd.DataFrame(columns=columns))
+    combined = {}
+    for col in columns:
+        parts = [chunk[col] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            combined[col] = union_categoricals(parts, ignore_order=True)
+        else:
+            combined[col] = pd.concat(parts, ignore_index=True)
+    return(normalize_sheet(pd.DataFrame(combined), columns))
+
+
+# Function that turns text IDs into numbers (the type read_excel gives them) by converting only the distinct values
+def numeric_ids(values):
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return(values)
+    try:
+        numbers = pd.to_numeric(values.cat.categories)
+        values = values.cat.rename_categories(numbers)
+    except (ValueError, TypeError):
+        return(values)   # IDs that aren't numbers (or that collide once converted, ie. "01" and "1") are kept as text
+    return(values.astype(numbers.dtype if values.notna().all() else 'float64'))
+
+
+# Function that stores a text column as a categorical holding only the values that occur, in sorted order
+# (the categories don't depend on which file or chunk the values came from)
+def compact_category(values):
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return(values.astype('category'))
+    values = values.cat.remove_unused_categories()
+    return(values.cat.reorder_categories(values.cat.categories.sort_values()))
+
+
+# Function that stores IDs in the smallest type that holds them: numeric IDs as compact integers, text IDs as categorical codes
+def compact_ids(values):
+    if pd.api.types.is_numeric_dtype(values) and values.notna().all() and (values % 1 == 0).all():
+        return(pd.to_numeric(values, downcast='integer'))
+    if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        return(compact_category(values))
+    return(values)   # numeric IDs with blanks stay as floats
+
+
+# Function that reads an Entry or Exit sheet exported as CSV (optionally gzipped) chunk by chunk
+# Every chunk is projected to the needed columns, compacted and deduplicated before the next one is read
+def read_csv_sheet(source, columns, chunksize=CSV_CHUNK_ROWS):
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    # gzip files are recognised by their magic number so the name doesn't need a .gz extension
+    if hasattr(source, 'read'):
+        compression = 'gzip' if source.read(2) == b'\x1f\x8b' else None
+        source.seek(0)
+    else:
+        with open(source, 'rb') as f:
+            compression = 'gzip' if f.read(2) == b'\x1f\x8b' else None
+
+    # Every value is read as text, like the text cells of the excel exports, so the chunks agree on their types
+    reader = pd.read_csv(source, usecols=lambda c: c.strip() in columns, dtype=str, chunksize=chunksize, compression=compression)
+    chunks = [normalize_sheet(chunk, columns).drop_duplicates() for chunk in reader]
+
+    df = concat_sheet_chunks(chunks, columns)
+    for col in ID_COLUMNS:
+        df[col] = numeric_ids(df[col])
+    return(df)
+
+
+# Function that tells from a CSV file name whether it holds the Entry or the Exit data
+def csv_sheet_name(name):
+    lower = os.path.basename(name).lower()
+    if 'entry' in lower:
+        return(ENTRY_SHEET)
+    if 'exit' in lower:
+        return(EXIT_SHEET)
+    raise ValueError(f"Can't tell whether '{name}' holds Entry or Exit data, please include 'entry' or 'exit' in the file name")
+
+
+# Function that checks whether a file name is a CSV export (plain or compressed) rather than an excel workbook
+def is_csv_name(name):
+    return(os.path.basename(name).lower().endswith(('.csv', '.csv.gz', '.gz')))
+
+
+# Function that checks whether a file name is a snapshot archive (see SJCoC_Snapshot) rather than an excel workbook
+def is_snapshot_name(name):
+    return(os.path.basename(name).lower().endswith('.zip'))
+
+
+# Function that opens a workbook once and reads both the Entry and Exit sheets in that single pass
+# extra_columns: Entry sheet columns to keep besides the ones performance() uses (ie. a project column to split the report by)
+def read_workbook(source, extra_columns=()):
+    from openpyxl import load_workbook   # only excel uploads need openpyxl, CSV files and snapshots are read without it
+
+    # Raw bytes (ie. the contents of a streamlit upload) are wrapped so openpyxl can treat them like a file
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    # read_only mode parses the sheet XML lazily row by row instead of building every cell in memory
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        entry = read_sheet_columns(wb, ENTRY_SHEET, ENTRY_COLUMNS + list(extra_columns))
+        exit = read_sheet_columns(wb, EXIT_SHEET, EXIT_COLUMNS)
+    finally:
+        wb.close()   # read_only workbooks keep the file handle open until closed
+
+    return(entry, exit)
+
+
+# Function that reads one uploaded file: an excel workbook or a snapshot holding both sheets, or a CSV file holding one of them
+# A CSV file fills in only its own sheet and leaves the other one as None
+def read_upload(name, source, extra_columns=()):
+    if is_snapshot_name(name):
+        from SJCoC_Snapshot import load_snapshot
+        if extra_columns:
+            raise ValueError(f"'{name}' is a snapshot, which only holds the columns the report uses and has no {', '.join(extra_columns)} column")
+        return(load_snapshot(source))
+    if not is_csv_name(name):
+        return(read_workbook(source, extra_columns))
+    if csv_sheet_name(name) == ENTRY_SHEET:
+        return(read_csv_sheet(source, ENTRY_COLUMNS + list(extra_columns)), None)
+    return(None, read_csv_sheet(source, EXIT_COLUMNS))
+
+
+# Function that hashes the contents of a file so identical uploads share a cache entry whatever their name
+def file_fingerprint(source):
+    if not isinstance(source, (bytes, bytearray)):
+        with open(source, 'rb') as f:
+            source = f.read()
+    return(hashlib.blake2b(source, digest_size=20).hexdigest())
+
+
+# Least recently used cache of parsed (Entry, Exit) dataframes, bounded by the memory the cached frames take up
+# An entry can hold other values next to its frames (ie. the fingerprint of the data, see read_normalized_uploads)
+class ParsedFileCache:
+
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._entries = OrderedDict()      # fingerprint -> (values, size in bytes of their dataframes)
+        self._lock = threading.Lock()      # streamlit serves every browser session from its own thread
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return(None)
+            self._entries.move_to_end(key)  # marks the entry as the most recently used
+            return(self._entries[key][0])
+
+    def put(self, key, *values):
+        size = sum(int(df.memory_usage(deep=True).sum()) for df in values if isinstance(df, pd.DataFrame))
+        # A file that alone is larger than the bound is not cached, it would only evict everything else
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (values, size)
+            self.used_bytes += size
+            # Evicting the least recently used files until the cache fits in its bound again
+            while self.used_bytes > self.max_bytes:
+                old_key, (old_values, old_size) = self._entries.popitem(last=False)
+                self.used_bytes -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+
+# Caches shared by every rerun of the streamlit script (imported modules stay loaded between reruns): the frames of each uploaded
+# file, and the normalized frames of each set of uploads
+upload_cache = ParsedFileCache()
+normalized_upload_cache = ParsedFileCache()
+
+
+# Function that gives the cache key of an uploaded file, the same file read with other columns is another entry
+def upload_key(source, extra_columns=()):
+    return(file_fingerprint(source) + ''.join('|' + col for col in extra_columns))
+
+
+# Function that reads a list of uploaded files (file objects or paths), spreading them across a pool of worker processes
+# When a cache is given, files whose contents were already parsed are taken from it instead of being read again
+# extra_columns: Entry sheet columns to keep besides the ones performance() uses (see read_workbook)
+def read_uploads(files, max_workers=None, cache=None, extra_columns=()):
+    # Uploaded files are passed to the workers as bytes since the streamlit file objects can't be sent between processes
+    names = [f.name if hasattr(f, 'name') else str(f) for f in files]
+    sources = [f.getvalue() if hasattr(f, 'getvalue') else f for f in files]
+
+    sheets = [None] * len(sources)
+    keys = [None] * len(sources)
+    if cache is not None:
+        for i, source in enumerate(sources):
+            keys[i] = upload_key(source, extra_columns)
+            sheets[i] = cache.get(keys[i])
+    missing = [i for i, s in enumerate(sheets) if s is None]
+
+    if max_workers is None:
+        max_workers = min(len(missing), os.cpu_count() or 1)
+
+    # A single file (or a single core) is read in this process, there is nothing to gain from starting a pool
+    if max_workers <= 1 or len(missing) <= 1:
+        parsed = []
+        for i in missing:
+            with stage(f'read {os.path.basename(names[i])}') as s:
+                parsed.append(read_upload(names[i], sources[i], extra_columns))
+                s.rows = sum(len(df) for df in parsed[-1] if df is not None)
+    else:
+        # (the memory the workers use isn't part of this process's RSS)
+        with stage(f'read {len(missing)} files in {max_workers} worker processes') as s, ProcessPoolExecutor(max_workers=max_workers) as pool:
+            parsed = list(pool.map(read_upload, [names[i] for i in missing], [sources[i] for i in missing], [extra_columns] * len(missing)))   # map keeps the results in upload order
+            s.rows = sum(len(df) for sheets in parsed for df in sheets if df is not None)
+
+    for i, (entry, exit) in zip(missing, parsed):
+        sheets[i] = (entry, exit)
+        if cache is not None:
+            cache.put(keys[i], entry, exit)
+
+    # The lists store the Entry and Exit dataframes of each file (CSV files only contribute to one of them)
+    d_entry = [entry for entry, exit in sheets if entry is not None]
+    d_exit = [exit for entry, exit in sheets if exit is not None]
+
+    return(d_entry, d_exit)
+
+
+# Function that reads a set of uploads into the one normalized Entry frame and Exit frame performance() takes, and fingerprints
+# them (see data_fingerprint). Returns (df_entry, df_exit, fingerprint)
+# The frames are cached for the files in their upload order, so the reruns that follow a widget change take them from the cache
+# instead of concatenating, normalizing and fingerprinting every row again; only the files' bytes are hashed
+def read_normalized_uploads(files, cache=None, file_cache=None, extra_columns=()):
+    from SJCoC_Pipeline import data_fingerprint
+
+    key = None
+    if cache is not None:
+        sources = [f.getvalue() if hasattr(f, 'getvalue') else f for f in files]
+        key = '+'.join(upload_key(source, extra_columns) for source in sources)
+        cached = cache.get(key)
+        if cached is not None:
+            return(cached)
+
+    d_entry, d_exit = read_uploads(files, cache=file_cache, extra_columns=extra_columns)
+    if not d_entry or not d_exit:
+        raise ValueError("Please upload both the Entry data and the Exit data.")
+
+    # The frames of the files are concatenated and normalized to the same columns and types that a snapshot stores
+    with stage('normalize sheets') as s:
+        df_entry = normalize_sheet(pd.concat(d_entry).reset_index(drop=True), ENTRY_COLUMNS + list(extra_columns))
+        df_exit = normalize_sheet(pd.concat(d_exit).reset_index(drop=True), EXIT_COLUMNS)
+        s.rows = len(df_entry) + len(df_exit)
+    with stage('fingerprint') as s:
+        fingerprint = data_fingerprint(df_entry, df_exit)
+        s.rows = len(df_entry) + len(df_exit)
+
+    if cache is not None:
+        cache.put(key, df_entry, df_exit, fingerprint)
+    return(df_entry, df_exit, fingerprint)
@@ -0,0 +1,331 @@
+# The reporting pipeline: cleans the Entry and Exit data, builds the Q23c performance table and the chart aggregates
+# A run is memoized per input fingerprint, so streamlit reruns (every widget change) reuse the previous result
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from SJCoC_Destinations import (permanent_category, temporary_category, institutional_setting_category, other_category,
+                                destination_categories)
+from SJCoC_Backends import get_backend, compact_clean
+from SJCoC_Diagnostics import timed, stage, rss_mb
+from SJCoC_Memory import memory_budget_mb, frames_mb, planned_chunks, enforcing, MemoryBudgetExceeded, MAX_CHUNKS
+
+
+# Function that creates the Performance Report Table
+# The cleaning, join and household counts run on the chosen compute backend (see SJCoC_Backends), the report layout is shared
+# memory_budget: MB (or 'auto') the process may use, see SJCoC_Memory. When the data is projected not to fit, or the budget is
+# exceeded while it runs, the data is cleaned and counted in groups of households instead, which gives the same report
+def performance(d_entry, d_exit, backend=None, memory_budget=None):
+    backend = get_backend(backend)
+
+    # Removing the tailing spaces behind the column names
+    d_entry.columns = d_entry.columns.str.strip()
+    d_exit.columns = d_exit.columns.str.strip()
+
+    budget_mb = memory_budget_mb(memory_budget)
+    chunks = 1 if budget_mb is None else planned_chunks(frames_mb(d_entry, d_exit), budget_mb)
+
+    if chunks == 1:
+        try:
+            with enforcing(budget_mb):
+                # The cleaned data that we call for subsequent data visualizations
+                with stage(f'clean ({backend.name})') as s:
+                    d_complete, unknown_destinations, duplicate_exit_keys = backend.clean(d_entry, d_exit)
+                    s.rows = len(d_complete)
+
+                # Distinct households of every destination and household type, counted over the heads of household with a move-in date
+                household_counts, moved_in_heads = backend.household_counts(d_complete)
+        except MemoryBudgetExceeded:
+            d_complete = None     # frees the partial result before the data is processed again in groups
+            chunks = 2
+
+    if chunks > 1:
+        with stage(f'clean and count in {chunks} household groups ({backend.name})') as s:
+            d_complete, unknown_destinations, duplicate_exit_keys, household_counts, moved_in_heads = partitioned_clean(d_entry, d_exit, backend, chunks, budget_mb)
+            s.rows = len(d_complete)
+
+    performance_table = q23c_table(household_counts, moved_in_heads)
+
+    # performance() fuction returns the cleaned data, the performance report dataframe, the destinations it couldn't categorize
+    # and the number of duplicate exit records it collapsed
+    return(d_complete,performance_table,unknown_destinations,duplicate_exit_keys)
+
+
+# Function that gives every row a hash of its Household ID, rows without one get 0 (so they all land in the first group)
+# Numeric IDs are hashed as floats, an ID that is an integer in one sheet and a float in the other (ie. an Exit sheet with blank IDs) gets one hash
+def household_hashes(ids):
+    if pd.api.types.is_numeric_dtype(ids):
+        ids = ids.astype('float64')
+    hashes = pd.util.hash_pandas_object(ids, index=False).to_numpy()
+    return(np.where(ids.isna().to_numpy(), np.uint64(0), hashes))
+
+
+# Function that cleans and counts the data one group of households at a time, for data that doesn't fit in the memory budget at once
+# Every value of the cleaned data depends only on the rows of its own household (the Household ID is part of the enrollment key,
+# move-in dates and household types are resolved per household), and a household is counted in a single group, so the counts
+# of the groups add up to the counts of the whole data
+# A group that exceeds the budget is split in two (group r of m becomes groups r and r+m of 2m), up to MAX_CHUNKS groups
+# (once the process holds more than the budget before a group starts, ie. memory the allocator kept, splitting can't help anymore
+# and the group runs without the budget)
+def partitioned_clean(d_entry, d_exit, backend, chunks, budget_mb):
+    entry_hashes = household_hashes(d_entry['Household ID'])
+    exit_hashes = household_hashes(d_exit['Household ID'])
+
+    parts, counts, unknown_destinations = [], [], set()
+    duplicate_exit_keys, moved_in_heads = 0, 0
+    pending = [(chunks, group) for group in range(chunks)]
+    while pending:
+        modulus, group = pending.pop(0)
+        entry = d_entry[entry_hashes % np.uint64(modulus) == group]
+        exit = d_exit[exit_hashes % np.uint64(modulus) == group]
+        can_split = budget_mb is not None and modulus * 2 <= MAX_CHUNKS and (rss_mb() or 0.0) < budget_mb
+        try:
+            with enforcing(budget_mb if can_split else None), stage(f'household group {group + 1} of {modulus}') as s:
+                clean, unknown, duplicates = backend.clean(entry, exit)
+                household_counts, heads = backend.household_counts(clean)
+                s.rows = len(clean)
+        except MemoryBudgetExceeded:
+            clean = None
+            pending = [(modulus * 2, group), (modulus * 2, group + modulus)] + pending
+            continue
+        parts.append(clean)
+        counts.append(household_counts)
+        unknown_destinations.update(unknown)
+        duplicate_exit_keys += duplicates
+        moved_in_heads += heads
+
+    # The groups hold different households, so their distinct household counts add up
+    household_counts = pd.concat(counts).groupby(level=0).sum().fillna(0).astype('int64')
+
+    # The categorical columns of every group get the same categories, so the groups concatenate without turning them into strings
+    # (rebuilding the frame column by column would hold another copy of the cleaned data at the peak)
+    for col in parts[0].columns:
+        if all(isinstance(part[col].dtype, pd.CategoricalDtype) for part in parts):
+            categories = union_categoricals([part[col] for part in parts], ignore_order=True).categories
+            for part in parts:
+                part[col] = part[col].cat.set_categories(categories)
+    clean = pd.concat(parts, ignore_index=True)
+    del parts
+    return(compact_clean(clean), sorted(unknown_destinations), duplicate_exit_keys, household_counts, moved_in_heads)
+
+
+# Function that lays out the Q23c performance report from the distinct households per Destination and Household Type
+# moved_in_heads is the number of heads of household with a move-in date and a destination type (the Percentage row's denominator)
+@timed('Q23c table layout')
+def q23c_table(household_counts, moved_in_heads):
+
+    # Household types in the column order of the performance report
+    household_types = ["Without Children", "With Children and Adults", "With Only Children", "Unknown"]
+    household_counts = household_counts.reindex(columns=household_types, fill_value=0)
+
+    #----------------------------------
+    # Function that lays out the household counts of one destination type (section header, one row per destination, subtotal)
+    def destination_table(dest_type, housing_destination_category):
+
+        # Destinations nobody exited to are kept in the report with zero counts
+        counts = household_counts.reindex(housing_destination_category, fill_value=0).to_numpy()
+
+        # Each destination row holds its destination, total number of households and the household counts by Household Type
+        df_list = [[dest_type]] + [[dest, row.sum()] + list(row) for dest, row in zip(housing_destination_category, counts)]
+
+        # List of table column names from the performance report (we will use this to rename columns when we convert counts to a pd dataframe)
+        table_col_names = ['Destination', 'Total', 'Without Children','With Children and Adults', "With Only Children","Unknown Household Type"]
+
+        # Converts the list of Destination type lists to a Pandas dataframe
+        df = pd.DataFrame(df_list, columns = table_col_names)
+
+        # Creating the subtotal row by summing the df column wise(excludes the first row and first column bc those are headers)
+        df.loc[len(df)] = ["Subtotal"] + list(df.iloc[1:, 1:].sum(axis = 0))
+
+        return(df)
+    #----------------------------------
+
+    # Concatenating the tables of the 4 destination types (Permanent, Temporary, Institutional Settings, Other) to make a collective table
+    performance_table = pd.concat([destination_table(dest_type, category) for dest_type, category in destination_categories]).reset_index(drop=True)
+
+    # Total Row: Sums all of the subtotal rows to get overall Total
+    performance_table.loc[len(performance_table)] = ["Total"] + list(performance_table[performance_table['Destination']=="Subtotal"].iloc[:,1:].sum(axis=0))
+
+    # Total persons exiting to positive housing destinations: Column sums on a subset dataframe that contains "Permananent Destinations" housing
+    performance_table.loc[len(performance_table)] = ["Total persons exiting to positive housing destinations"] + list(performance_table[performance_table['Destination'].isin(permanent_category)].iloc[:,1:].sum(axis=0))
+
+    # Total persons whose destinations excluded them from the calculation: Everyone else that is not in "Permanent Destinations"
+    performance_table.loc[len(performance_table)] = ["Total persons whose destinations excluded them from the calculation"] + list(performance_table[performance_table['Destination'].isin(temporary_category+institutional_setting_category+other_category)].iloc[:,1:].sum(axis=0))
+
+    # Percentage: Number of households per category divided by the total number of households with a move-in date
+    performance_table.loc[len(performance_table)] = ["Percentage"] + list(round(performance_table[performance_table["Destination"]=="Total"].iloc[:, 1:].sum(axis=0) / moved_in_heads *100,2).astype(str)+ '%')
+
+    return(performance_table)
+
+
+# =============================================================================
+# Grouped reports: one Q23c table per slice of the cleaned data (ie. per project, agency or fiscal year)
+
+# Slicing the report by the fiscal year of the exit date instead of a column, HUD's fiscal year starts in October
+# (FY 2021 runs from October 1st 2020 to September 30th 2021)
+FISCAL_YEAR = 'Fiscal Year'
+FISCAL_YEAR_START_MONTH = 10
+
+# Label of the slice holding the rows that have no value in the column the report is split by
+BLANK_SLICE = '(blank)'
+
+
+# Function that gives the fiscal year every date falls in
+def fiscal_years(dates):
+    return(dates.dt.year + (dates.dt.month >= FISCAL_YEAR_START_MONTH))
+
+
+# Function that gives every row of the cleaned data the label of the slice it belongs to
+# group_by: FISCAL_YEAR, or an Entry column the cleaned data carries (see SJCoC_Backends.entry_columns)
+def report_slices(clean, group_by):
+    if group_by == FISCAL_YEAR:
+        return('FY ' + fiscal_years(clean['Enrollment Exit Date']).astype('int64').astype(str))
+    if group_by not in clean.columns:
+        raise KeyError(f"Can't split the report by '{group_by}', the data has no such column (read the Entry sheet with it as an extra column)")
+    values = clean[group_by].astype(object)
+    return(values.where(values.notna(), BLANK_SLICE).astype(str))
+
+
+# Function that creates the Performance Report Table of every slice of the cleaned data
+# The households of all slices are counted in one grouped pass, instead of running the pipeline once per slice
+# Returns a list of (label, performance table, fiscal year or None) in label order
+def grouped_performance(clean, group_by, backend=None):
+    backend = get_backend(backend)
+    sliced = backend.grouped_household_counts(clean, report_slices(clean, group_by))
+    return([(label, q23c_table(household_counts, moved_in_heads), int(label[3:]) if group_by == FISCAL_YEAR else None)
+            for label, (household_counts, moved_in_heads) in sliced.items()])
+
+
+# =============================================================================
+# Age ranges of the age chart, each range includes its lower bound
+age_range_labels = ['Under 5','5-12','13-17','18-24','25-34','35-44','45-54','55-61','62+']
+age_range_bins = [-np.inf, 5, 13, 18, 25, 35, 45, 55, 62, np.inf]
+
+
+# Function that counts the individuals per age range, plus the individuals without an age ('No Answer')
+def age_range_counts(ages):
+    age_ranges = pd.cut(ages, bins=age_range_bins, labels=age_range_labels, right=False).value_counts(sort=False)
+    return(pd.Series(list(age_ranges.reindex(age_range_labels, fill_value=0)) + [int(ages.isna().sum())], index=age_range_labels + ['No Answer']))
+
+
+# Function that lays out the counts of a demographic column (Gender, Race, Ethnicity) for its pie chart
+def demographic_table(name, counts):
+    counts = counts[counts > 0]    # categories nobody in the data belongs to are left out
+    return(pd.DataFrame({name: counts.index.astype(object), 'value': counts.to_numpy()}))
+
+
+# Function that counts the values of a demographic column (Gender, Race, Ethnicity), missing values included
+def demographic_counts(values):
+    return(demographic_table(values.name, values.value_counts(dropna=False, sort=False)))
+
+
+# Function that sums the move-in counts per month between the first and last move-in date, given the number of distinct
+# individuals and households per move-in date (months without move-in dates are kept with a count of 0)
+def monthly_move_in_counts(client_dates, household_dates):
+    if len(client_dates) == 0:
+        return(pd.DataFrame({'Month Year': [], 'Client Counts': [], 'Household Counts': []}))
+
+    months = pd.period_range(client_dates.index.min(), client_dates.index.max(), freq='M')
+    unique_counts = client_dates.groupby(client_dates.index.to_period('M')).sum().reindex(months, fill_value=0)
+    household_counts = household_dates.groupby(household_dates.index.to_period('M')).sum().reindex(months, fill_value=0)
+
+    return(pd.DataFrame({'Month Year': months.strftime('%B %Y'),
+                         'Client Counts': unique_counts.to_numpy(),
+                         'Household Counts': household_counts.to_numpy()}))
+
+
+# Function that counts the individuals and households with a move-in date in every month between the first and last move-in date
+def move_in_counts(clean):
+    move_in = clean[clean["Housing Move-In Date"].notna()]
+
+    # Each individual/household is counted once per move-in date
+    unique_ID = move_in[["Unique ID", "Housing Move-In Date"]].drop_duplicates()
+    household_ID = move_in[["Household ID", "Housing Move-In Date"]].drop_duplicates()
+
+    return(monthly_move_in_counts(unique_ID["Housing Move-In Date"].value_counts(), household_ID["Housing Move-In Date"].value_counts()))
+
+
+# Function that computes the chart aggregates that come straight from the performance report
+def table_aggregates(performance_table):
+    aggregates = {}
+
+    # Households per destination type (the Subtotal rows of the performance report)
+    destination_totals = performance_table[performance_table['Destination'] == 'Subtotal']['Total'].to_numpy()
+    aggregates['destinations'] = pd.DataFrame({'Destination Type': ['Permanent', 'Temporary', 'Institutional Setting', 'Other'],
+                                               'Total': destination_totals})
+
+    # Households per household type (the Total row of the performance report)
+    household_totals = performance_table[performance_table['Destination'] == 'Total'].iloc[0, 2:]
+    aggregates['household_types'] = pd.DataFrame({'Household Type': household_totals.index, 'Count': household_totals.to_numpy()})
+
+    return(aggregates)
+
+
+# Function that computes the aggregates behind every chart from the cleaned data and the performance report
+@timed('chart aggregates')
+def chart_aggregates(clean, performance_table):
+    aggregates = table_aggregates(performance_table)
+
+    # Individuals per age range, plus the individuals without an age
+    age_ranges = age_range_counts(clean['Age'])
+    aggregates['age_ranges'] = pd.DataFrame({'Age Range': age_ranges.index, 'Client Count': age_ranges.to_numpy()})
+
+    # Individuals per gender, race and ethnicity
+    for col in ['Gender', 'Race', 'Ethnicity']:
+        aggregates[col] = demographic_counts(clean[col])
+
+    # Individuals and households with a move-in date per month
+    aggregates['move_in'] = move_in_counts(clean)
+
+    return(aggregates)
+
+
+# =============================================================================
+# Named stages of one pipeline run, every consumer in the app reads from this object
+#   clean: cleaned enrollment data, performance_table: Q23c table, charts: chart aggregates,
+#   unknown_destinations / duplicate_exit_keys: what the cleaning stage reported
+PipelineResult = namedtuple('PipelineResult', ['fingerprint', 'clean', 'performance_table', 'charts', 'unknown_destinations', 'duplicate_exit_keys'])
+
+# Number of pipeline results kept (one per distinct set of input data), the least recently used one is dropped first
+PIPELINE_MEMO_SIZE = 4
+_pipeline_memo = OrderedDict()
+_pipeline_memo_lock = threading.Lock()
+
+
+# Function that fingerprints the Entry and Exit data by hashing their rows, identical data gives an identical fingerprint
+def data_fingerprint(d_entry, d_exit):
+    digest = hashlib.blake2b(digest_size=20)
+    for df in (d_entry, d_exit):
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        digest.update(str(len(df)).encode())   # keeps the entry/exit boundary part of the fingerprint
+    return(digest.hexdigest())
+
+
+# Function that runs the pipeline once per set of input data, later calls with the same data return the memoized result
+# The returned dataframes are shared between calls, so consumers must not modify them
+# Every backend gives the same result (so does a run within a memory budget), so the memo is shared by all of them
+def run_pipeline(d_entry, d_exit, fingerprint=None, backend=None, memory_budget=None):
+    if fingerprint is None:
+        with stage('fingerprint') as s:
+            fingerprint = data_fingerprint(d_entry, d_exit)
+            s.rows = len(d_entry) + len(d_exit)
+
+    with _pipeline_memo_lock:
+        if fingerprint in _pipeline_memo:
+            _pipeline_memo.move_to_end(fingerprint)
+            with stage('pipeline (memoized result)'):
+                return(_pipeline_memo[fingerprint])
+
+    clean, performance_table, unknown_destinations, duplicate_exit_keys = performance(d_entry, d_exit, backend, memory_budget)
+    result = PipelineResult(fingerprint, clean, performance_table, chart_aggregates(clean, performance_table),
+                            unknown_destinations, duplicate_exit_keys)
+
+    with _pipeline_memo_lock:
+        _pipeline_memo[fingerprint] = result
+        while len(_pipeline_memo) > PIPELINE_MEMO_SIZE:
+            _pipeline_memo.popitem(last=False)
+
+    return(result)
@@ -0,0 +1,188 @@
+# Layout of the Q23c worksheet: where the performance table and the report titles go, and how their cells are formatted
+# Plain python only, so the layout can be imported without pandas or an excel writer
+
+from functools import lru_cache
+
+# The performance table is written starting at this (1-based) worksheet row, its header goes on the row above
+START_ROW = 14
+
+# Worksheet columns the 6 columns of the performance table are written to (0-based)
+WRITE_COLS = [0, 1, 2, 5, 7, 9]
+
+# Worksheet rows of the black lines above and below the report title (1-based) and the columns they span
+BLACK_LINE_ROWS = [2, 10]
+BLACK_LINE_COLS = range(1, 12)
+
+# Row (0-based) the date and time the report was made is written to, in the example format: Wed Mar 24 09:45:11 PM 2021
+REPORT_DATE_ROW = 63
+REPORT_DATE_FORMAT = "%a %b %d %I:%M:%S %p %Y"
+
+# Titles of the report, the title takes the fiscal year the report was made in
+REPORT_TITLE = "HUD Annual Performance Report (FY {year})"
+COC_TITLE = "CA-511: Central Valley Housing"
+FILTER_TITLES = [("D5:K5", ""),
+                 ("D6:K6", "Agency cat. filter: Agency CoC"),
+                 ("D7:K7", "Client Location filter: No"),
+                 ("D8:K8", "Funding Criteria: Not Based on Funding Source")]
+QUESTION_TITLE = "Q23c. Exit Destination"
+APPLICABILITY_TITLE = "Program Applicability: All Projects"
+SLICE_APPLICABILITY_TITLE = "Program Applicability: {column} {label}"   # the sheet of one slice of a grouped report
+
+# Excel sheet names are at most 31 characters long and can't hold any of these characters
+SHEET_NAME_LENGTH = 31
+SHEET_NAME_INVALID = '[]:*?/\\'
+
+# Heights of the worksheet rows and widths of the worksheet columns, starting at the first row/column
+ROW_HEIGHTS = [4.5, 1.5, 4.5, 27, 19.5, 19.5, 19.5, 19.5, 6.75, 0.75, 19.5, 19.5, 19.5, 31.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 0, 19.5, 31.5]
+COL_WIDTHS = [25.57, 15, 5.57, 3.43, 4.57, 12.4, 2.14, 9.71, 4.57, 11.71, 2.57]
+
+# Cell formats of the worksheet, by name, as xlsxwriter format properties
+FORMATS = {
+    'black_line': {'bg_color':'black'},
+    'title': {'align': 'center','font_name': 'Arial','font_size': 16,'valign': 'vcenter','text_wrap': 1,'right': 1},
+    'coc_title': {'font_name': 'Arial','font_size': 14,'text_wrap': 1,'bold': 1,'valign': 'vcenter','align': 'right'},
+    'filter_title': {'font_name': 'Arial','font_size': 12,'text_wrap': 1,'valign': 'vcenter','align': 'right'},
+    'question_title': {'font_name': 'Arial','font_size': 11,'text_wrap': 1,'bold': 1,'valign': 'vcenter','align': 'left','top': 1,'right': 1,'left': 1,'bg_color': '#EDF3FE','border_color': '#999999'},
+    'applicability_title': {'font_name': 'Arial','font_size': 11,'text_wrap': 1,'valign': 'vcenter','align': 'left','left': 1,'right': 1,'bg_color': '#EDF3FE','border_color': "#999999"},
+    'header': {'font_name':'Arial','font_size':10,'align':'center','valign':'top','num_format': '@','border':1,'text_wrap': True,'bg_color':'#E9E9E8'},
+    'index_section': {'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'bold':1,'text_wrap': True,'bg_color':'#E9E9E8'},
+    'index_sums': {'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'text_wrap': True},
+    'numbers_sums': {'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'text_wrap': True},
+    'index_subtotal': {'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'bold':1,'text_wrap': True},
+    'numbers_subtotal': {'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'bold':1,'text_wrap': True},
+    'index_total_main': {'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'bottom':1,'bottom_color':'#999999','text_wrap': True},
+    'numbers_total_main': {'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'bottom':1,'bottom_color':'#999999','text_wrap': True},
+    'index_total_addit': {'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'border_color':'#999999','text_wrap': True},
+    'numbers_total_addit': {'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'border_color':'#999999','text_wrap': True},
+    'index_total_percent': {'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'border_color':'#999999','text_wrap': True},
+    'numbers_total_percent': {'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0.00%','border':1,'border_color':'#999999','text_wrap': True},
+    'data_date': {'num_format': 'mm/dd/yyyy'},    # dates of the data sheets (the cleaned data, the synthetic exports)
+}
+
+# Formats of the index column and of the number columns of each kind of performance table row (see row_kinds)
+ROW_FORMATS = {
+    'section': ('index_section', 'index_section'),
+    'sums': ('index_sums', 'numbers_sums'),
+    'subtotal': ('index_subtotal', 'numbers_subtotal'),
+    'total_main': ('index_total_main', 'numbers_total_main'),
+    'total_addit': ('index_total_addit', 'numbers_total_addit'),
+    'total_percent': ('index_total_percent', 'numbers_total_percent'),
+}
+
+
+# Function that turns a 1-based column number into its excel column letters (ie. 1 -> A, 28 -> AB)
+def colnum_string(n):
+    string = ""
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        string = chr(65 + remainder) + string
+    return string
+
+
+# Function that gives the 0-based row and column of an excel cell (ie. D5 -> (4, 3))
+def cell_rowcol(cell):
+    letters = cell.rstrip('0123456789')
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - 64
+    return(int(cell[len(letters):]) - 1, col - 1)
+
+
+# Function that gives the last worksheet column (0-based) a table value written to a worksheet column is merged across
+# The Destination column is merged over 3 cells and the number columns over 2 cells
+def merge_last_col(col):
+    if col == 2:
+        return(col + 2)
+    return(col + 1)
+
+
+# Function that gives the kind of each performance table row (see ROW_FORMATS) from its Destination and whether its Total is blank
+# Section headings have no Total, and the rows from the first Total down are the totals: the Total, the additional rows and the percentage
+def row_kinds(destinations, blank_totals):
+    destinations = list(destinations)
+    kinds = ['section' if blank else 'sums' for blank in blank_totals]
+    if 'Total' in destinations:
+        first_total = destinations.index('Total')
+        for row in range(first_total, len(kinds)):
+            kinds[row] = 'total_addit'
+        kinds[first_total] = 'total_main'
+        kinds[-1] = 'total_percent'
+    for row, destination in enumerate(destinations):
+        if destination == 'Subtotal':
+            kinds[row] = 'subtotal'
+    return(tuple(kinds))
+
+
+# Function that compiles the cells of a Q23c worksheet whose performance table has rows of these kinds, once for every table shape
+# Returns the worksheet rows in order as (0-based row, height or None, runs), a run being (first column, format name, fields) of cells
+# side by side that share a format, and the merged ranges as (first row, first column, last row, last column, format name, field)
+# A field tells where the value of a cell comes from: None (blank), ('table', (row, col)), ('header', col), ('title', name) or ('text', text)
+@lru_cache(maxsize=None)
+def compile_layout(kinds):
+    cells = {}      # 0-based row -> {0-based column: (format name, field)}
+    merges = []
+
+    def put(row, col, fmt, field, last_row=None, last_col=None):
+        last_row = row if last_row is None else last_row
+        last_col = col if last_col is None else last_col
+        for r in range(row, last_row + 1):
+            for c in range(col, last_col + 1):
+                cells.setdefault(r, {})[c] = (fmt, field if (r, c) == (row, col) else None)   # the other merged cells are blank
+        if (last_row, last_col) != (row, col):
+            merges.append((row, col, last_row, last_col, fmt, field))
+
+    def put_range(cell_range, fmt, field):
+        (first_row, first_col), (last_row, last_col) = [cell_rowcol(cell) for cell in cell_range.split(':')]
+        put(first_row, first_col, fmt, field, last_row, last_col)
+
+    # black cells that mimic lines above and below the report title
+    for row in BLACK_LINE_ROWS:
+        for col in BLACK_LINE_COLS:
+            put(row - 1, col - 1, 'black_line', None)
+    # the report title, the CoC, the filters and the Q23c and Program Applicability titles
+    put_range('A4:C8', 'title', ('title', 'report_title'))
+    put_range('D4:K4', 'coc_title', ('title', 'coc_title'))
+    for cell_range, title in FILTER_TITLES:
+        put_range(cell_range, 'filter_title', ('text', title))
+    put_range('A12:K12', 'question_title', ('text', QUESTION_TITLE))
+    put_range('A13:K13', 'applicability_title', ('title', 'applicability'))
+    # the header of the performance table, and then its rows: the Destination and number columns are merged across several cells
+    for j, col in enumerate(WRITE_COLS):
+        put(START_ROW - 1, col, 'header', ('header', j), last_col=merge_last_col(col) if col >= 2 else None)
+    for i, kind in enumerate(kinds):
+        index_format, number_format = ROW_FORMATS[kind]
+        if kind == 'section':
+            # section headings are merged across the table width
+            put(START_ROW + i, WRITE_COLS[0], index_format, ('table', (i, 0)), last_col=WRITE_COLS[-1] + 1)
+            continue
+        put(START_ROW + i, WRITE_COLS[0], index_format, ('table', (i, 0)))
+        for j, col in enumerate(WRITE_COLS[1:], start=1):
+            put(START_ROW + i, col, number_format, ('table', (i, j)), last_col=merge_last_col(col) if col >= 2 else None)
+    # the date and time the report was made
+    put(REPORT_DATE_ROW, 0, None, ('title', 'report_date'))
+
+    # the rows that only have a height are listed too, without any cells
+    rows = []
+    for row in sorted(set(cells) | set(range(len(ROW_HEIGHTS)))):
+        runs = []
+        for col in sorted(cells.get(row, {})):
+            fmt, field = cells[row][col]
+            if runs and runs[-1][1] == fmt and runs[-1][0] + len(runs[-1][2]) == col:
+                runs[-1][2].append(field)
+            else:
+                runs.append((col, fmt, [field]))
+        height = ROW_HEIGHTS[row] if row < len(ROW_HEIGHTS) else None
+        rows.append((row, height, tuple((col, fmt, tuple(fields)) for col, fmt, fields in runs)))
+    return(tuple(rows), tuple(merges))
+
+
+# Function that turns a slice label into a valid sheet name that isn't in used yet (ie. "Project A/B" -> "Project A_B", "... (2)")
+def sheet_name(label, used):
+    name = ''.join('_' if c in SHEET_NAME_INVALID else c for c in str(label)).strip("' ") or 'Blank'
+    name = name[:SHEET_NAME_LENGTH]
+    candidate, n = name, 2
+    while candidate.lower() in used:     # excel compares sheet names ignoring case
+        suffix = f" ({n})"
+        candidate, n = name[:SHEET_NAME_LENGTH - len(suffix)] + suffix, n + 1
+    used.add(candidate.lower())
+    return(candidate)
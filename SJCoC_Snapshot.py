@@ -0,0 +1,49 @@
+# Functions that save and load a columnar snapshot of the ingested Entry and Exit data
+# A snapshot is a zip archive holding one Parquet file per sheet, which loads far faster than re-reading the excel files
+
+import zipfile
+from io import BytesIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+from SJCoC_Ingest import ENTRY_SHEET, EXIT_SHEET, ENTRY_COLUMNS, EXIT_COLUMNS, normalize_sheet
+
+# Version of the snapshot layout, bumped whenever the stored columns or their types change
+# 1: dates stored as text, 2: dates stored as timestamps
+SNAPSHOT_SCHEMA_VERSION = 2
+SCHEMA_VERSION_KEY = b'sjcoc_schema_version'
+
+
+# Function that writes the normalized Entry and Exit dataframes to a snapshot (a file path or a writable file object)
+def save_snapshot(df_entry, df_exit, target):
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_STORED) as archive:   # parquet is already compressed
+        for sheet, df, columns in [(ENTRY_SHEET, df_entry, ENTRY_COLUMNS), (EXIT_SHEET, df_exit, EXIT_COLUMNS)]:
+            table = pa.Table.from_pandas(normalize_sheet(df, columns), preserve_index=False)
+            # Stamping the schema version into the parquet metadata next to the pandas column types
+            table = table.replace_schema_metadata({**table.schema.metadata, SCHEMA_VERSION_KEY: str(SNAPSHOT_SCHEMA_VERSION).encode()})
+            buffer = BytesIO()
+            pq.write_table(table, buffer, compression='zstd')
+            archive.writestr(sheet + '.parquet', buffer.getvalue())
+
+
+# Function that returns the snapshot as bytes (used for the streamlit download link)
+def snapshot_bytes(df_entry, df_exit):
+    output = BytesIO()
+    save_snapshot(df_entry, df_exit, output)
+    return(output.getvalue())
+
+
+# Function that reads a snapshot back into the Entry and Exit dataframes
+def load_snapshot(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    sheets = []
+    with zipfile.ZipFile(source) as archive:
+        for sheet in [ENTRY_SHEET, EXIT_SHEET]:
+            table = pq.read_table(BytesIO(archive.read(sheet + '.parquet')))
+            version = int((table.schema.metadata or {}).get(SCHEMA_VERSION_KEY, b'0'))
+            if version != SNAPSHOT_SCHEMA_VERSION:
+                raise ValueError(f"Snapshot '{sheet}' has schema version {version}, this app reads version {SNAPSHOT_SCHEMA_VERSION}. Please re-upload the excel files.")
+            sheets.append(table.to_pandas())
+
+    return(sheets[0], sheets[1])
@@ -0,0 +1,221 @@
+# Synthetic HMIS data: Entry and Exit data that look like our exports, at any scale (ie. 10k to 10M enrollments)
+# Used by the benchmarks (SJCoC_Benchmark.py) and to try the report without real client data
+#
+# Usage:
+#   python SJCoC_Synthetic.py 100000 -o synthetic                  (one workbook holding both sheets)
+#   python SJCoC_Synthetic.py 10000000 -o synthetic --format csv   (gzipped entry and exit CSV files)
+
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from SJCoC_Ingest import ENTRY_SHEET, EXIT_SHEET, ENTRY_COLUMNS, EXIT_COLUMNS
+from SJCoC_Dates import DATE_COLUMNS, DATE_FORMAT
+from SJCoC_Destinations import permanent_category, temporary_category, institutional_setting_category, other_category
+
+# Share of the households of each size
+HOUSEHOLD_SIZES = {1: 0.55, 2: 0.18, 3: 0.12, 4: 0.08, 5: 0.05, 6: 0.02}
+
+# Share of the households exiting to each kind of destination
+# (unknown: a destination that is in no category, ie. a misspelled one, missing: no destination recorded)
+DESTINATION_MIX = {'permanent': 0.42, 'temporary': 0.22, 'institutional': 0.05, 'other': 0.21, 'unknown': 0.002, 'missing': 0.098}
+DESTINATIONS = {'permanent': permanent_category, 'temporary': temporary_category,
+                'institutional': institutional_setting_category, 'other': other_category,
+                'unknown': ["Rental by client, no ongoing subsidy (old label)"], 'missing': [None]}
+
+# Share of the clients without a date of birth, of the households that left the program and that moved into housing
+MISSING_DOB_RATE = 0.02
+EXIT_RATE = 0.9
+MOVE_IN_RATE = 0.6
+
+# Share of the rows exported twice, and of the exits recorded twice with another destination
+DUPLICATE_RATE = 0.01
+DUPLICATE_EXIT_RATE = 0.002
+
+# Demographic answers (HMIS data standards) with their shares
+GENDERS = {"Female": 0.46, "Male": 0.5, "Transgender": 0.01, "A gender other than singularly female or male (e.g., non-binary, genderfluid, agender, culturally specific gender)": 0.005,
+           "Questioning": 0.002, "Client refused": 0.003, "Data not collected": 0.02}
+RACES = {"White": 0.5, "Black, African American, or African": 0.22, "Asian or Asian American": 0.08, "American Indian, Alaska Native, or Indigenous": 0.04,
+         "Native Hawaiian or Pacific Islander": 0.02, "Multi-Racial": 0.1, "Client doesn't know": 0.01, "Data not collected": 0.03}
+ETHNICITIES = {"Non-Hispanic/Non-Latin(a)(o)(x)": 0.55, "Hispanic/Latin(a)(o)(x)": 0.42, "Client doesn't know": 0.01, "Data not collected": 0.02}
+OTHER_DESTINATIONS = ["Staying with a friend", "Moved out of state", "Unknown"]
+
+# Enrollments start within these years
+START_DATE = '2019-01-01'
+START_DAYS = 3 * 365
+
+# Rows written to one workbook (an excel sheet holds at most 1,048,576 rows), larger data is split into several workbooks
+ROWS_PER_WORKBOOK = 1000000
+
+
+# Function that draws one of the keys of a {value: share} dict for every row, as an object array sharing one string per value
+def choose(rng, shares, size):
+    values = np.empty(len(shares), dtype=object)
+    values[:] = list(shares)
+    p = np.array(list(shares.values()), dtype=float)
+    return(values[rng.choice(len(values), size=size, p=p / p.sum())])
+
+
+# Function that generates the Entry and Exit data of the given number of enrollments (one client in one household each)
+# The frames hold the columns the exports give read_workbook, with excel dates (or text dates when text_dates is set)
+def synthetic_frames(enrollments, seed=0, household_sizes=HOUSEHOLD_SIZES, missing_dob=MISSING_DOB_RATE, destination_mix=DESTINATION_MIX,
+                     exit_rate=EXIT_RATE, move_in_rate=MOVE_IN_RATE, duplicate_rate=DUPLICATE_RATE, duplicate_exit_rate=DUPLICATE_EXIT_RATE,
+                     text_dates=False):
+    rng = np.random.default_rng(seed)
+
+    # Household sizes are drawn until they hold every enrollment, the last household is cut to fit
+    sizes = np.array(list(household_sizes), dtype='int64')
+    p = np.array(list(household_sizes.values()), dtype=float)
+    sizes = rng.choice(sizes, size=int(enrollments / (sizes * p / p.sum()).sum() * 1.1) + 10, p=p / p.sum())
+    while sizes.sum() < enrollments:
+        sizes = np.concatenate([sizes, sizes])
+    ends = np.cumsum(sizes)
+    households = int(np.searchsorted(ends, enrollments)) + 1
+    sizes = sizes[:households]
+    sizes[-1] -= ends[households - 1] - enrollments
+    household = np.repeat(np.arange(households), sizes)
+    member = np.arange(enrollments) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    head = member == 0
+
+    # Every household enrolls, leaves and moves in together (not every member has the move-in date recorded)
+    day = np.timedelta64(1, 'D')
+    start = np.datetime64(START_DATE, 'D') + rng.integers(0, START_DAYS, households) * day
+    stay = rng.integers(7, 540, households)
+    exit = np.where(rng.random(households) < exit_rate, start + stay * day, np.datetime64('NaT'))
+    move_in = np.where(rng.random(households) < move_in_rate, start + (rng.random(households) * np.minimum(stay, 90)).astype('int64') * day, np.datetime64('NaT'))
+    member_move_in = np.where(head | (rng.random(enrollments) < 0.7), move_in[household], np.datetime64('NaT'))
+
+    # Every household exits to one destination, drawn from a kind of destination and then from its destinations
+    kinds = choose(rng, destination_mix, households)
+    destination = np.empty(households, dtype=object)
+    for kind, category in DESTINATIONS.items():
+        rows = np.flatnonzero(kinds == kind)
+        options = np.empty(len(category), dtype=object)
+        options[:] = category
+        destination[rows] = options[rng.integers(0, len(category), len(rows))]
+    other = np.where(np.isin(destination, ["Other"]), choose(rng, dict.fromkeys(OTHER_DESTINATIONS, 1), households), None)
+
+    # Heads of household are adults (a few youth households are headed by a minor), other members are mostly children
+    youth = rng.random(households) < 0.02
+    child = np.where(head, youth[household], (rng.random(enrollments) < 0.65) | youth[household])
+    age = np.where(child, rng.integers(0, 18, enrollments), rng.integers(18, 80, enrollments))
+    age = np.where(head & youth[household], rng.integers(16, 18, enrollments), age)
+    dob = start[household] - (age * 365.25 + rng.integers(0, 365, enrollments)).astype('int64') * day
+    dob = np.where(rng.random(enrollments) < missing_dob, np.datetime64('NaT'), dob)
+    relationship = np.where(head, "Self (head of household)",
+                            np.where(child, "Head of household's child",
+                                     np.where(member == 1, "Head of household's spouse or partner", "Head of household's other relation member"))).astype(object)
+
+    common = {"Unique ID": 100000 + np.arange(enrollments), "Enrollment Start Date": start[household], "Enrollment Exit Date": exit[household],
+              "DOB": dob, "Household ID": 500000 + household, "Gender": choose(rng, GENDERS, enrollments),
+              "Race": choose(rng, RACES, enrollments), "Ethnicity": choose(rng, ETHNICITIES, enrollments)}
+    d_entry = pd.DataFrame(dict(common, **{"Relationship to Head of Household": relationship, "Housing Move-In Date": member_move_in}))
+    d_exit = pd.DataFrame(dict(common, **{"Destination": destination[household], "Specify Other Exit Destination": other[household]}))
+    d_exit = d_exit[d_exit['Enrollment Exit Date'].notna()]
+
+    # Rows exported twice follow their first copy, like in the exports
+    d_entry = d_entry.iloc[np.repeat(np.arange(len(d_entry)), 1 + (rng.random(len(d_entry)) < duplicate_rate))]
+    repeats = 1 + (rng.random(len(d_exit)) < duplicate_rate + duplicate_exit_rate)
+    d_exit = d_exit.iloc[np.repeat(np.arange(len(d_exit)), repeats)].reset_index(drop=True)
+
+    # Some of the repeated exit records are an earlier exit record of the enrollment, with another destination
+    first_copies = np.flatnonzero(np.repeat(repeats > 1, repeats))[::2]     # the repeated rows come in pairs
+    earlier = first_copies[rng.random(len(first_copies)) < duplicate_exit_rate / (duplicate_rate + duplicate_exit_rate)]
+    d_exit.loc[earlier, 'Destination'] = "Emergency shelter, including hotel or motel paid for with emergency shelter voucher, or RHY-funded Host Home shelter"
+
+    d_entry, d_exit = d_entry.reset_index(drop=True), d_exit[EXIT_COLUMNS]
+    if text_dates:
+        d_entry, d_exit = text_date_columns(d_entry), text_date_columns(d_exit)
+    return(d_entry[ENTRY_COLUMNS], d_exit)
+
+
+# Function that turns the date columns into text dates like the CSV exports hold (each distinct date is formatted once)
+def text_date_columns(df):
+    df = df.copy()
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            codes, dates = pd.factorize(df[col])
+            text = np.empty(len(dates) + 1, dtype=object)
+            text[:-1] = dates.strftime(DATE_FORMAT)
+            text[-1] = None        # code -1 marks a missing date
+            df[col] = text[codes]
+    return(df)
+
+
+# Function that numbers the workbook every Entry and Exit row goes to, a household is never split across workbooks
+def workbook_parts(d_entry, d_exit, rows_per_workbook=ROWS_PER_WORKBOOK):
+    households = d_entry['Household ID'].to_numpy()
+    first_rows = pd.Series(np.arange(len(households))).groupby(households).min()
+    parts = first_rows // rows_per_workbook
+    return(parts.reindex(households).to_numpy(), parts.reindex(d_exit['Household ID'].to_numpy()).fillna(0).astype('int64').to_numpy())
+
+
+# Function that writes the synthetic data as workbooks holding both sheets, split into several workbooks when it doesn't fit in one
+# Returns the paths of the workbooks written
+def write_workbooks(d_entry, d_exit, directory, name='synthetic', rows_per_workbook=ROWS_PER_WORKBOOK):
+    from SJCoC_Worksheet_Format import ReportWorkbook
+
+    os.makedirs(directory, exist_ok=True)
+    entry_parts, exit_parts = workbook_parts(d_entry, d_exit, rows_per_workbook)
+    paths = []
+    for part in range(int(entry_parts.max()) + 1 if len(entry_parts) else 1):
+        path = os.path.join(directory, f"{name}.xlsx" if entry_parts.max(initial=0) == 0 else f"{name}_{part + 1}.xlsx")
+        book = ReportWorkbook(path)
+        book.add_data_sheet(d_entry[entry_parts == part], ENTRY_SHEET)
+        book.add_data_sheet(d_exit[exit_parts == part], EXIT_SHEET)
+        book.close()
+        paths.append(path)
+    return(paths)
+
+
+# Function that writes the synthetic data as an entry and an exit CSV file (gzipped unless compress is False)
+# Returns the paths of the two files written
+def write_csvs(d_entry, d_exit, directory, name='synthetic', compress=True):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for sheet, df in (('entry', d_entry), ('exit', d_exit)):
+        path = os.path.join(directory, f"{name}_{sheet}.csv" + ('.gz' if compress else ''))
+        df.to_csv(path, index=False, date_format=DATE_FORMAT)
+        paths.append(path)
+    return(paths)
+
+
+# Function that parses a share option of the command line (ie. "1=0.5,2=0.3,3=0.2") into a {value: share} dict
+def parse_shares(text, key=str):
+    shares = {}
+    for item in text.split(','):
+        value, share = item.split('=')
+        shares[key(value.strip())] = float(share)
+    return(shares)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic HMIS Entry and Exit data for the SJCoC report.")
+    parser.add_argument('enrollments', type=int, help="number of enrollments (rows of the Entry data before duplicates)")
+    parser.add_argument('-o', '--output', default='.', help="directory the files are written to (default: current directory)")
+    parser.add_argument('--name', default='synthetic', help="file name the files start with (default: synthetic)")
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv'], help="workbooks holding both sheets, or gzipped entry and exit CSV files (default: xlsx)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed gives the same data")
+    parser.add_argument('--household-sizes', default=None, help="shares of the household sizes, ie. 1=0.6,2=0.25,4=0.15")
+    parser.add_argument('--destination-mix', default=None, help=f"shares of the kinds of destinations, of: {', '.join(DESTINATION_MIX)}")
+    parser.add_argument('--missing-dob', type=float, default=MISSING_DOB_RATE, help=f"share of the clients without a date of birth (default: {MISSING_DOB_RATE})")
+    args = parser.parse_args(argv)
+
+    household_sizes = parse_shares(args.household_sizes, int) if args.household_sizes else HOUSEHOLD_SIZES
+    destination_mix = parse_shares(args.destination_mix) if args.destination_mix else DESTINATION_MIX
+    unknown = [kind for kind in destination_mix if kind not in DESTINATIONS]
+    if unknown:
+        parser.error(f"unknown kinds of destinations {unknown}, choose from: {', '.join(DESTINATIONS)}")
+
+    d_entry, d_exit = synthetic_frames(args.enrollments, args.seed, household_sizes, args.missing_dob, destination_mix)
+    if args.format == 'csv':
+        paths = write_csvs(d_entry, d_exit, args.output, args.name)
+    else:
+        paths = write_workbooks(d_entry, d_exit, args.output, args.name)
+    print(f"wrote {len(d_entry)} entry rows and {len(d_exit)} exit rows to {', '.join(paths)}")
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
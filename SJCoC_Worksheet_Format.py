@@ -1,188 +1,143 @@
-import numpy as np
-import xlsxwriter
-import pandas as pd
-
-def  writeToWorksheet(wr,df,name):
-    def colnum_string(n):
-        string = ""
-        while n > 0:
-            n, remainder = divmod(n - 1, 26)
-            string = chr(65 + remainder) + string
-        return string
-    
-    def write_manual_titles_to_wks(wkb,wks):
-        # get date and time the code was run
-        import datetime
-        x = datetime.datetime.now()
-        # remove library from ram
-        del datetime 
-        # fill in black cells that mimic lines above and below Anual Performance Report
-        fmt_black_line = wkb.add_format({'bg_color':'black'})
-        row_list = [2,10]
-        for row_itr in row_list:
-            for col_itr in range(1, 12):
-                cell_reference = colnum_string(col_itr) + str(row_itr)
-                wks.write(cell_reference,'',fmt_black_line)
-        del fmt_black_line, row_itr, col_itr, row_list,cell_reference
-        # write and format "HUD FUCJ Annual Performance Report (FY YYYY)" title
-        fmt_merge_title = wkb.add_format({'align': 'center','font_name': 'Arial','font_size': 16,'valign': 'vcenter','text_wrap': 1,'right': 1})
-        wks.merge_range('A4:C8', f"HUD FUCJ Annual Performance Report (FY {x.year})", fmt_merge_title)
-        del fmt_merge_title
-        # write and format the title for CA-511: Central Valley Housing
-        fmt_merge_sub1 = wkb.add_format({'font_name': 'Arial','font_size': 14,'text_wrap': 1,'bold': 1,'valign': 'vcenter','align': 'right'})
-        wks.merge_range('D4:K4', "CA-511: Central Valley Housing", fmt_merge_sub1)
-        del fmt_merge_sub1
-        # write and format the titles beneath the top header Central Valley Housing
-        fmt_merge_sub = wkb.add_format({'font_name': 'Arial','font_size': 12,'text_wrap': 1,'valign': 'vcenter','align': 'right'})
-        wks.merge_range('D5:K5', "", fmt_merge_sub)
-        wks.merge_range('D6:K6', "Agency cat. filter: Agency CoC", fmt_merge_sub)
-        wks.merge_range('D7:K7', "Client Location filter: No", fmt_merge_sub)
-        wks.merge_range('D8:K8', "Funding Criteria: Not Based on Funding Source", fmt_merge_sub)
-        del fmt_merge_sub
-        # write and format the Q23c. Exit Destination title in blue
-        fmt_merge_lower1 = wkb.add_format({'font_name': 'Arial','font_size': 11,'text_wrap': 1,'bold': 1,'valign': 'vcenter','align': 'left','top': 1,'right': 1,'left': 1,'bg_color': '#EDF3FE','border_color': '#999999'})
-        wks.merge_range('A12:K12', "Q23c. Exit Destination", fmt_merge_lower1)
-        del fmt_merge_lower1
-        # write and format the Program Applicability: All Projects title in blue
-        fmt_merge_lower2 = wkb.add_format({'font_name': 'Arial','font_size': 11,'text_wrap': 1,'valign': 'vcenter','align': 'left','left': 1,'right': 1,'bg_color': '#EDF3FE','border_color': "#999999"})
-        wks.merge_range('A13:K13', "Program Applicability: All Projects", fmt_merge_lower2)
-        del fmt_merge_lower2
-        # write report date at the bottom of the worksheet in the example format: Wed Mar 24 09:45:11 PM 2021
-        wks.write(63, 0,x.strftime("%a %b %d %I:%M:%S %p %Y"))
-        
-    def write_df_to_wks(wkb,wks,df,start_row):
-        
-        def write_df_row_to_wks(wks,df,spacer,idx_format,num_format,row_merge=False):
-            write_cols = [0,1,2,5,7,9]
-            if row_merge == False:
-                for idx, row in df.iterrows():
-                    zipped_vals = list(zip(write_cols,row))
-                    row_number = idx + spacer
-                    wks.write(row_number,zipped_vals[0][0],zipped_vals[0][1],idx_format)
-                    for col, val in zipped_vals[1:]:
-                        if col >= 2 :
-                            merge_row_number = str(row_number + 1)
-                            merge_starting_column = colnum_string(col+1)
-                            if col == 2:
-                                merge_ending_column =  colnum_string(col + 3)
-                            else:
-                                merge_ending_column = colnum_string(col + 2)
-                            # outputs an excel range in the format A1:A5 for merging purposes 
-                            string_range = merge_starting_column + merge_row_number + ":" + merge_ending_column + merge_row_number
-                            # merges cells listed in string range, writes value, formats merged cells
-                            wks.merge_range(string_range,val,num_format)                    
-                        else:
-                            # writes value directly to cell and formats
-                            wks.write(row_number,col,val,num_format)
-            else:
-                for idx, row in df.iterrows():
-                    val = row[0]
-                    merge_starting_column = colnum_string(write_cols[0]+1)
-                    merge_ending_column =  colnum_string(write_cols[-1]+2)
-                    row_number = idx + spacer
-                    merge_row_number = str(row_number + 1)
-                    # outputs an excel range in the format A1:A5 for merging purposes
-                    string_range = merge_starting_column + merge_row_number + ":" + merge_ending_column + merge_row_number
-                    # merges cells listed in string range, writes value, formats merged cells
-                    wks.merge_range(string_range,val,num_format)
-
-        def write_df_to_wks_headers(wkb,wks,df,start_row):
-            fmt_header = wkb.add_format({'font_name':'Arial','font_size':10,'align':'center','valign':'top','num_format': '@','border':1,'text_wrap': True,'bg_color':'#E9E9E8'})
-            headers_list = df.columns.tolist()
-            headers_list[0] = ''
-            write_cols = [0,1,2,5,7,9]
-            row_number = start_row-1
-            for col, val in zip(write_cols,headers_list):
-                if col >= 2 :
-                    merge_row_number = str(row_number + 1)
-                    merge_starting_column = colnum_string(col+1)
-                    if col == 2:
-                        merge_ending_column =  colnum_string(col + 3)
-                    else:
-                        merge_ending_column = colnum_string(col + 2)
-                    # outputs an excel range in the format A1:A5 for merging purposes 
-                    string_range = merge_starting_column + merge_row_number + ":" + merge_ending_column + merge_row_number
-                    # merges cells listed in string range, writes value, formats merged cells
-                    wks.merge_range(string_range,val,fmt_header)                    
-                else:
-                    # writes value directly to cell and formats
-                    wks.write(row_number,col,val,fmt_header)
-
-        def write_df_to_wks_section_headings(wkb,wks,df,rows,start_row):
-            fmt_index_section = wkb.add_format({'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'bold':1,'text_wrap': True,'bg_color':'#E9E9E8'})
-            write_df_row_to_wks(wks, df.iloc[rows], start_row, fmt_index_section, fmt_index_section,row_merge=True)
-
-        def write_df_to_wks_sums(wkb,wks,df,rows,start_row):
-            fmt_index_sums = wkb.add_format({'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'text_wrap': True})
-            fmt_numbers_sums = wkb.add_format({'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'text_wrap': True})
-            write_df_row_to_wks(wks, df.iloc[rows], start_row, fmt_index_sums, fmt_numbers_sums)
-
-        def write_df_to_wks_subtotals(wkb,wks,df,rows,start_row):
-            fmt_index_subtotal = wkb.add_format({'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'bold':1,'text_wrap': True})
-            fmt_numbers_subtotal = wkb.add_format({'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'bold':1,'text_wrap': True})
-            write_df_row_to_wks(wks, df.iloc[rows] , start_row, fmt_index_subtotal, fmt_numbers_subtotal)
-
-        def write_df_to_wks_totals(wkb,wks,df,rows,start_row):
-
-            def write_df_to_wks_totals_main(wkb,wks,df,rows,start_row):
-                fmt_index_total_main = wkb.add_format({'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'bottom':1,'bottom_color':'#999999','text_wrap': True})
-                frmt_numbers_total_main = wkb.add_format({'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'bottom':1,'bottom_color':'#999999','text_wrap': True})
-                write_df_row_to_wks(wks, df.iloc[[rows]] , start_row, fmt_index_total_main, frmt_numbers_total_main)
-
-            def write_df_to_wks_totals_addit(wkb,wks,df,rows,start_row):
-                fmt_index_total_addit = wkb.add_format({'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'border_color':'#999999','text_wrap': True})
-                frmt_numbers_total_addit = wkb.add_format({'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0','border':1,'border_color':'#999999','text_wrap': True})
-                write_df_row_to_wks(wks, df.iloc[rows] , start_row, fmt_index_total_addit, frmt_numbers_total_addit)
-
-            def write_df_to_wks_totals_percent(wkb,wks,df,rows,start_row):
-                fmt_index_total_percent = wkb.add_format({'font_name':'Arial','font_size':10,'align':'left','valign':'vcenter','num_format': '@','border':1,'border_color':'#999999','text_wrap': True})
-                fmt_numbers_total_percent = wkb.add_format({'font_name':'Arial','font_size':10,'align':'center','valign':'vcenter','num_format': '0.00%','border':1,'border_color':'#999999','text_wrap': True})
-                write_df_row_to_wks(wks, df.iloc[[rows]] , start_row, fmt_index_total_percent, fmt_numbers_total_percent)
-
-            write_df_to_wks_totals_main(wkb,wks,df,rows[0],start_row)
-            write_df_to_wks_totals_addit(wkb,wks,df,rows[1:len(rows)-1],start_row)
-            write_df_to_wks_totals_percent(wkb,wks,df,rows[-1],start_row)        
-        
-        #----------Write Headers to top of Worksheet------
-        write_df_to_wks_headers(wkb,wks,df,start_row)
-        #----------Write Section Separators to Worksheet------
-        destination_sections = df[df['Total'].isna()].index.values
-        write_df_to_wks_section_headings(wkb,wks,df,destination_sections,start_row)
-        #----------Write Totals to Worksheet------
-        destination_totals = list(range(int(df[df['Destination']=='Total'].index[0]),len(df.index)))
-        write_df_to_wks_totals(wkb,wks,df,destination_totals,start_row)
-        #----------Write Subtotals to Worksheet------
-        destination_subtotals = df[df['Destination']=='Subtotal'].index.values
-        write_df_to_wks_subtotals(wkb,wks,df,destination_subtotals,start_row)
-        #----------Write Sums to Worksheet-------
-        ignored_rows = np.append(destination_sections, [destination_subtotals, destination_totals])
-        destination_sums = df.loc[~df.index.isin(ignored_rows)].index.values
-        write_df_to_wks_sums(wkb,wks,df,destination_sums,start_row)
-        
-    def fmt_row_heights(wks):
-        #~~~~~~~~~~Adjusting Row Heights~~~~~~~~~~
-        row_heights = [4.5, 1.5, 4.5, 27, 19.5, 19.5, 19.5, 19.5, 6.75, 0.75, 19.5, 19.5, 19.5, 31.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 19.5, 0, 19.5, 31.5]
-        for r_no, r_height in enumerate(row_heights):
-            wks.set_row(r_no, r_height)
-
-    def fmt_col_widths(wks):
-        #~~~~~~~~~~Adjusting Column Widths~~~~~~~~~~
-        col_widths = [25.57, 15, 5.57, 3.43, 4.57, 12.4, 2.14, 9.71, 4.57, 11.71, 2.57]
-        for col_no, c_width in enumerate(col_widths):
-            wks.set_column(col_no, col_no, c_width)
-
-    # create workbook and worksheet objects
-    workbook = wr.book
+from io import BytesIO
+from SJCoC_Diagnostics import timed
+from SJCoC_Q23c_Layout import (REPORT_DATE_FORMAT, REPORT_TITLE, COC_TITLE, APPLICABILITY_TITLE, SLICE_APPLICABILITY_TITLE,
+                               COL_WIDTHS, FORMATS, row_kinds, compile_layout, sheet_name)
+
+# Rows of a data sheet converted to python values at a time (see write_data_sheet)
+DATA_SHEET_CHUNK_ROWS = 10000
+
+
+# Cell formats of one workbook by name (see FORMATS), a format is added to the workbook the first time a sheet uses it
+# so a workbook holds every distinct format once, however many sheets it has
+class FormatPool:
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.formats = {}
+
+    def __getitem__(self, name):
+        fmt = self.formats.get(name)
+        if fmt is None:
+            fmt = self.formats[name] = self.workbook.add_format(FORMATS[name])
+        return(fmt)
+
+
+# Excel workbook the report is written to
+# constant_memory: xlsxwriter's constant_memory mode, every row is written to a temporary file as soon as the next row starts, so
+# large data sheets take flat memory (the sheets have to be written row by row). Q23c sheets merge cells across rows, which
+# merge_range can only do in a workbook without it (a Q23c sheet is about 64 rows, it takes little memory either way)
+# target: path or file object the workbook is written to, None writes it to memory and close() returns its bytes
+class ReportWorkbook:
+
+    def __init__(self, target=None, constant_memory=True):
+        import xlsxwriter
+        self.output = BytesIO() if target is None else target
+        self.constant_memory = constant_memory
+        self.workbook = xlsxwriter.Workbook(self.output, {'constant_memory': constant_memory})
+        self.sheet_names = set()     # names of the sheets added so far, lower case (see sheet_name)
+        self.formats = FormatPool(self.workbook)
+
+    # Function that adds a sheet holding a performance table, name: sheet name (made valid and unique)
+    def add_q23c_sheet(self, df, name='Q23c', coc_title=COC_TITLE, year=None, applicability=APPLICABILITY_TITLE):
+        if self.constant_memory:
+            raise ValueError("Q23c sheets merge cells across rows, add them to a ReportWorkbook opened with constant_memory=False")
+        writeToWorksheet(self.workbook, df, sheet_name(name, self.sheet_names), coc_title, year, applicability, self.formats)
+
+    # Function that adds a sheet holding a dataframe, a header row and then one row per record
+    def add_data_sheet(self, df, name):
+        write_data_sheet(self.workbook, sheet_name(name, self.sheet_names), df, self.formats)
+
+    def close(self):
+        self.workbook.close()
+        if isinstance(self.output, BytesIO):
+            return(self.output.getvalue())
+
+
+# wr: xlsxwriter workbook (or pandas ExcelWriter) the worksheet is added to
+# coc_title: CoC the report is for, year: report year in the title (default: the current year)
+# applicability: projects the report covers, written beneath the Q23c title
+# formats: format pool of the workbook shared by its sheets (by default the sheet gets a pool of its own)
+# The cells are laid out by the plan compiled once for the shape of the table (see compile_layout), written row by row and then merged
+def  writeToWorksheet(wr,df,name,coc_title=COC_TITLE,year=None,applicability=APPLICABILITY_TITLE,formats=None):
+    # get date and time the code was run
+    import datetime
+    x = datetime.datetime.now()
+
+    rows, merges = compile_layout(row_kinds(df['Destination'].tolist(), df['Total'].isna().tolist()))
+    table = df.to_numpy(dtype=object)
+    headers = [''] + df.columns.tolist()[1:]
+    titles = {'report_title': REPORT_TITLE.format(year=x.year if year is None else year), 'coc_title': coc_title,
+              'applicability': applicability, 'report_date': x.strftime(REPORT_DATE_FORMAT)}   # ie. Wed Mar 24 09:45:11 PM 2021
+
+    def value(field):
+        if field is None:
+            return('')
+        source, key = field
+        if source == 'table':
+            return(table[key])
+        if source == 'header':
+            return(headers[key])
+        if source == 'title':
+            return(titles[key])
+        return(key)
+
+    # create workbook and worksheet objects, the formats are added to the workbook once and shared by its worksheets
+    workbook = getattr(wr, 'book', wr)
+    worksheet = workbook.add_worksheet(name)
+    formats = FormatPool(workbook) if formats is None else formats
+
+    #~~~~~~~~~~Writing the rows in order and adjusting their heights~~~~~~~~~~
+    for row_number, height, runs in rows:
+        if height is not None:
+            worksheet.set_row(row_number, height)
+        for first_col, fmt, fields in runs:
+            worksheet.write_row(row_number, first_col, [value(field) for field in fields], None if fmt is None else formats[fmt])
+
+    #~~~~~~~~~~Merging the ranges (merge_range writes their first cell again and blanks the others with the same format)~~~~~~~~~~
+    for first_row, first_col, last_row, last_col, fmt, field in merges:
+        worksheet.merge_range(first_row, first_col, last_row, last_col, value(field), None if fmt is None else formats[fmt])
+
+    #~~~~~~~~~~Adjusting Column Widths~~~~~~~~~~
+    for col_no, c_width in enumerate(COL_WIDTHS):
+        worksheet.set_column(col_no, col_no, c_width)
+
+
+# Function that writes a dataframe to a new worksheet row by row (so it streams in a constant_memory workbook)
+# The rows are converted to python values DATA_SHEET_CHUNK_ROWS at a time, blank values leave their cell empty, dates take the data_date format
+def write_data_sheet(workbook, name, df, formats=None):
+    import pandas as pd
     worksheet = workbook.add_worksheet(name)
-    
-    # write the dataframe to the worksheet starting at row 14
-    write_df_to_wks(workbook, worksheet, df, start_row=14)
-    
-    # manually write in the values for the report title
-    write_manual_titles_to_wks(workbook, worksheet)
-    
-    # format the heights of each row
-    fmt_row_heights(worksheet)
-    
-    # format the widths of each column
-    fmt_col_widths(worksheet)
\ No newline at end of file
+    worksheet.write_row(0, 0, list(df.columns))
+    date_format = (FormatPool(workbook) if formats is None else formats)['data_date']
+    dates = [pd.api.types.is_datetime64_dtype(df[col]) for col in df.columns]
+    for start in range(0, len(df), DATA_SHEET_CHUNK_ROWS):
+        chunk = df.iloc[start:start + DATA_SHEET_CHUNK_ROWS]
+        columns = [chunk[col].dt.to_pydatetime() if is_date else chunk[col].to_numpy(dtype=object) for col, is_date in zip(df.columns, dates)]
+        for row, values in enumerate(zip(*columns), start=start + 1):
+            for col, value in enumerate(values):
+                if value is None or value != value:     # blank cells stay empty (NaN and NaT are the only values not equal to themselves)
+                    continue
+                if dates[col]:
+                    worksheet.write_datetime(row, col, value, date_format)
+                else:
+                    worksheet.write(row, col, value)
+
+
+# Function that converts the pandas performance_table df to an excel file
+# target: path or file object the excel file is written to, by default its bytes are returned
+@timed('Excel writing')
+def to_excel(df, coc_title=COC_TITLE, year=None, target=None):
+    book = ReportWorkbook(target, constant_memory=False)
+    book.add_q23c_sheet(df, 'Q23c', coc_title, year)
+    return(book.close())
+
+
+# Function that writes the performance tables of a grouped report (see grouped_performance) to one excel file, a sheet per slice
+# A fiscal year slice takes its year in the title, any other slice is named in the Program Applicability title
+@timed('Excel writing (grouped)')
+def grouped_to_excel(slices, group_by, coc_title=COC_TITLE, target=None):
+    book = ReportWorkbook(target, constant_memory=False)
+    for label, df, year in slices:
+        applicability = APPLICABILITY_TITLE if year is not None else SLICE_APPLICABILITY_TITLE.format(column=group_by, label=label)
+        book.add_q23c_sheet(df, label, coc_title, year, applicability)
+    return(book.close())
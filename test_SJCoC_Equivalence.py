@@ -0,0 +1,105 @@
+# Regression tests: every way of computing the report gives the same result on synthetic HMIS data (see SJCoC_Synthetic)
+#   the pandas and polars backends, an incremental report and a full run over the same files, and a run cleaned in household
+#   groups (a memory budget) and one cleaned at once
+# Run with: python -m pytest test_SJCoC_Equivalence.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from SJCoC_Synthetic import synthetic_frames
+from SJCoC_Ingest import normalize_sheet, ENTRY_COLUMNS, EXIT_COLUMNS
+from SJCoC_Backends import get_backend
+from SJCoC_Pipeline import performance, partitioned_clean, q23c_table, chart_aggregates
+from SJCoC_Incremental import IncrementalReport
+
+# Enrollments of the synthetic data the tests run on
+ENROLLMENTS = 5000
+
+
+# Function that gives the normalized Entry and Exit data of a synthetic dataset
+def synthetic_data(enrollments=ENROLLMENTS, seed=0):
+    d_entry, d_exit = synthetic_frames(enrollments, seed)
+    return(normalize_sheet(d_entry, ENTRY_COLUMNS), normalize_sheet(d_exit, EXIT_COLUMNS))
+
+
+# Function that puts the rows of a cleaned frame in one order (runs that clean the households in another order list them differently)
+def sorted_rows(clean):
+    clean = clean.astype({col: object for col in clean.columns if isinstance(clean[col].dtype, pd.CategoricalDtype)})
+    return(clean.sort_values(list(clean.columns)).reset_index(drop=True))
+
+
+# Function that checks two performance() results are the same: the cleaned data, the table and what the cleaning reported
+def assert_same_result(result, expected, same_row_order=True):
+    if same_row_order:
+        pd.testing.assert_frame_equal(result[0], expected[0])
+    else:
+        pd.testing.assert_frame_equal(sorted_rows(result[0]), sorted_rows(expected[0]), check_dtype=False)
+    pd.testing.assert_frame_equal(result[1], expected[1])
+    assert result[2] == expected[2]
+    assert result[3] == expected[3]
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_polars_backend_matches_pandas(seed):
+    pytest.importorskip('polars')
+    d_entry, d_exit = synthetic_data(seed=seed)
+    expected = performance(d_entry.copy(), d_exit.copy(), 'pandas')
+    assert expected[3] > 0      # the data has duplicate exit records to collapse
+    assert_same_result(performance(d_entry.copy(), d_exit.copy(), 'polars'), expected)
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_report_does_not_depend_on_row_order(backend):
+    if backend == 'polars':
+        pytest.importorskip('polars')
+    d_entry, d_exit = synthetic_data(seed=2)
+    expected = performance(d_entry.copy(), d_exit.copy(), backend)
+    shuffled = d_exit.sample(frac=1, random_state=3).reset_index(drop=True)
+    result = performance(d_entry.copy(), shuffled, backend)
+    pd.testing.assert_frame_equal(result[1], expected[1])
+    assert result[3] == expected[3]
+
+
+def test_incremental_report_matches_full_run():
+    d_entry, d_exit = synthetic_data(seed=3)
+
+    # Three monthly files: the rows are spread over the months (so households span several files), and every month repeats
+    # a few rows of the months before it
+    rng = np.random.default_rng(3)
+    entry_month, exit_month = rng.integers(0, 3, len(d_entry)), rng.integers(0, 3, len(d_exit))
+    files = []
+    for month in range(3):
+        entry, exit = d_entry[entry_month == month], d_exit[exit_month == month]
+        if month:
+            entry = pd.concat([entry, d_entry[entry_month < month].sample(frac=0.05, random_state=month)])
+            exit = pd.concat([exit, d_exit[exit_month < month].sample(frac=0.05, random_state=month)])
+        files.append((normalize_sheet(entry, ENTRY_COLUMNS), normalize_sheet(exit, EXIT_COLUMNS)))
+
+    report = IncrementalReport()
+    for month, (entry, exit) in enumerate(files):
+        report.append(entry, exit, files=[str(month)])
+        result = report.result()
+        full = performance(pd.concat([f[0] for f in files[:month + 1]]).reset_index(drop=True),
+                           pd.concat([f[1] for f in files[:month + 1]]).reset_index(drop=True))
+        assert_same_result((result.clean, result.performance_table, result.unknown_destinations, result.duplicate_exit_keys), full,
+                           same_row_order=False)
+        charts = chart_aggregates(full[0], full[1])
+        for name in charts:
+            pd.testing.assert_frame_equal(result.charts[name].reset_index(drop=True), charts[name].reset_index(drop=True),
+                                          check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('chunks', [2, 7])
+def test_household_groups_match_one_pass(chunks):
+    d_entry, d_exit = synthetic_data(seed=4)
+    expected = performance(d_entry.copy(), d_exit.copy())
+    clean, unknown_destinations, duplicate_exit_keys, household_counts, moved_in_heads = partitioned_clean(d_entry, d_exit, get_backend(), chunks, None)
+    assert_same_result((clean, q23c_table(household_counts, moved_in_heads), unknown_destinations, duplicate_exit_keys), expected,
+                       same_row_order=False)
+
+
+def test_memory_budget_matches_unbudgeted_run():
+    # a budget far below what the process holds makes performance() clean the data in household groups
+    d_entry, d_exit = synthetic_data(1000, seed=5)
+    expected = performance(d_entry.copy(), d_exit.copy())
+    assert_same_result(performance(d_entry.copy(), d_exit.copy(), memory_budget=1), expected, same_row_order=False)
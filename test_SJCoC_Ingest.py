@@ -0,0 +1,53 @@
+# Regression tests: excel workbooks are read in full whatever size their sheets state in the <dimension> tag
+# Run with: python -m pytest test_SJCoC_Ingest.py
+
+import re
+import zipfile
+from io import BytesIO
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from SJCoC_Synthetic import synthetic_frames
+from SJCoC_Ingest import read_workbook, ENTRY_SHEET, EXIT_SHEET, ENTRY_COLUMNS, EXIT_COLUMNS
+
+
+# Function that writes synthetic Entry and Exit data as an excel workbook whose rows end at their last filled cell
+# (openpyxl doesn't write blank cells, so rows with a blank Housing Move-In Date or Specify Other Exit Destination are shorter)
+def synthetic_workbook(enrollments=200, seed=0):
+    d_entry, d_exit = synthetic_frames(enrollments, seed)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, df, columns in [(ENTRY_SHEET, d_entry, ENTRY_COLUMNS), (EXIT_SHEET, d_exit, EXIT_COLUMNS)]:
+        ws = wb.create_sheet(name)
+        ws.append(columns)
+        for row in df[columns].astype(object).where(df[columns].notna(), None).itertuples(index=False):
+            ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return(buffer.getvalue())
+
+
+# Function that replaces the <dimension> tag of every sheet of a workbook (an empty tag removes it)
+def with_dimension_tag(data, tag):
+    source = zipfile.ZipFile(BytesIO(data))
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as target:
+        for item in source.infolist():
+            content = source.read(item.filename)
+            if item.filename.startswith('xl/worksheets/'):
+                content, replaced = re.subn(rb'<dimension ref="[^"]*"\s*/>', tag, content)
+                assert replaced == 1
+            target.writestr(item, content)
+    return(buffer.getvalue())
+
+
+@pytest.mark.parametrize('tag', [b'', b'<dimension ref="A1"/>', b'<dimension ref="A1:C5"/>'])
+def test_workbook_is_read_whatever_its_dimension_tag(tag):
+    data = synthetic_workbook()
+    expected = read_workbook(data)
+    assert len(expected[0]) == len(pd.read_excel(BytesIO(data), sheet_name=ENTRY_SHEET))
+    assert expected[0]['Housing Move-In Date'].isna().any()     # the sheet has rows of different length
+
+    result = read_workbook(with_dimension_tag(data, tag))
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    pd.testing.assert_frame_equal(result[1], expected[1])